@@ -0,0 +1,143 @@
+"""
+sound and music for the dungeon game
+
+Nothing touches the audio device until init() is called, so the game logic
+can be imported and run without sound. Until then, or when no device is
+available, a silent backend is used.
+"""
+import os
+import queue
+import threading
+
+MUSIC_PATH = os.path.split(__file__)[0] + '/music'
+SOUND_PATH = os.path.split(__file__)[0] + '/sounds'
+SOUND_EXTENSIONS = (".ogg", ".wav", ".mp3")
+
+# game events that have a sound effect, loaded from sounds/<event>.ogg|wav|mp3
+SOUND_EVENTS = ("coin", "trap", "door", "stairs")
+
+FADE_MS = 1500          # cross-fade between level music
+SOUND_CHANNELS = 8      # channels for sound effects, music uses two more
+
+
+def find_file(path, name):
+    for extension in SOUND_EXTENSIONS:
+        filename = os.path.join(path, name + extension)
+        if os.path.exists(filename):
+            return filename
+    return None
+
+
+class NullAudio:
+    """Silent backend for headless runs and machines without an audio device."""
+
+    def play(self, event):
+        pass
+
+    def play_music(self, name):
+        pass
+
+    def stop_music(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MixerAudio:
+    """
+    pygame mixer backend. Sound effects are preloaded into a pool of Sound
+    objects. Music is decoded and cross-faded on a background thread, so the
+    main loop never waits for audio I/O.
+    """
+
+    def __init__(self):
+        from pygame import mixer
+        mixer.init()
+        mixer.set_num_channels(SOUND_CHANNELS + 2)
+        mixer.set_reserved(2)       # channel 0 and 1 alternate for music
+        self.mixer = mixer
+        self.sounds = {}
+        for event in SOUND_EVENTS:
+            filename = find_file(SOUND_PATH, event)
+            if filename:
+                self.sounds[event] = mixer.Sound(filename)
+        self.music_channels = [mixer.Channel(0), mixer.Channel(1)]
+        self.music = {}             # decoded music by name
+        self.current_music = None   # last requested music
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self.music_worker, daemon=True)
+        self.worker.start()
+
+    def play(self, event):
+        sound = self.sounds.get(event)
+        if sound is not None:
+            sound.play()
+
+    def play_music(self, name):
+        if name != self.current_music:
+            self.current_music = name
+            self.requests.put(name)
+
+    def stop_music(self):
+        self.current_music = None
+        self.requests.put("")
+
+    def close(self):
+        self.requests.put(None)
+        self.worker.join(timeout=1)
+        self.mixer.quit()
+
+    def music_worker(self):
+        while True:
+            name = self.requests.get()
+            if name is None:
+                break
+            if not self.requests.empty():
+                continue    # a newer request is waiting, skip this one
+            old, new = self.music_channels
+            old.fadeout(FADE_MS)
+            if name:
+                sound = self.load_music(name)
+                if sound is not None:
+                    new.play(sound, loops=-1, fade_ms=FADE_MS)
+                    self.music_channels = [new, old]
+
+    def load_music(self, name):
+        if name not in self.music:
+            filename = find_file(MUSIC_PATH, name)
+            self.music[name] = self.mixer.Sound(filename) if filename else None
+        return self.music[name]
+
+
+backend = NullAudio()
+
+def init(headless=False):
+    """
+    Opens the audio device. Falls back to the silent backend
+    for headless runs or when the device cannot be opened.
+    """
+    global backend
+    if isinstance(backend, MixerAudio):
+        return backend
+    if not headless:
+        try:
+            backend = MixerAudio()
+        except (ImportError, RuntimeError) as e:     # no pygame or no audio device (pygame.error)
+            print(f"No sound: {e}")
+            backend = NullAudio()
+    return backend
+
+def close():
+    global backend
+    backend.close()
+    backend = NullAudio()
+
+def play(event):
+    backend.play(event)
+
+def play_music(name):
+    backend.play_music(name)
+
+def stop_music():
+    backend.stop_music()
@@ -0,0 +1,273 @@
+"""
+plays the levels many times to see how hard they are
+
+Every level of LEVELS is played over and over by agents on a pool of
+processes, each play starting on that level with full health:
+
+    random  presses a random key (or none) every tick
+    seek    walks the shortest way to the stairs, fetching the key first
+            if the door is still closed, with a random step now and then
+
+A play ends on the stairs, with the player's death or after max_ticks.
+The report shows per level and agent how many plays survived and reached
+the stairs, the damage taken by source (traps, fireballs and every type
+of monster), the coins collected and how many ticks it took to the stairs.
+
+The level templates are parsed once and handed to the workers, which put
+them into their level cache, so no worker reads level_data again. Plays
+are sent in batches and the report grows as the batches finish.
+
+    python balance.py --plays 2000 --agent random seek --levels 1 2 3
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+import game as game_logic
+from game import DungeonGame, tick, hit_points
+from levels import LEVELS, SECRET_LEVELS, WALKABLE, DIRECTIONS, NEIGHBOURS, level_cache
+
+MAX_TICKS = 20000       # about five and a half minutes at 60 ticks per second
+BATCH_SIZE = 50         # plays per task sent to a worker
+SEEK_RANDOM = 0.1       # share of random steps of the seek agent, so it does not get stuck
+
+# damage of the play that is running in this process, source -> points
+damage_taken = {}
+
+
+#
+# counting damage
+#
+
+def instrument():
+    """
+    Wraps the damage functions of game.py so every point of health or armor
+    lost is counted in damage_taken under its source: "trap", "fireball" or
+    "monster:<type>". Coins stolen by rats are counted as "coins_stolen".
+    """
+    take_damage = game_logic.take_damage
+    take_damage_monster = game_logic.take_damage_monster
+    check_collision = game_logic.check_collision
+    source = ["trap"]      # take_damage() outside check_collision() comes from a trap
+
+    def counted_take_damage(game):
+        before = hit_points(game)
+        take_damage(game)
+        add_damage(source[0], before - hit_points(game))
+
+    def counted_take_damage_monster(game, monster):
+        before, coins = hit_points(game), game.coins
+        take_damage_monster(game, monster)
+        add_damage("monster:" + monster.type, before - hit_points(game))
+        add_damage("coins_stolen", coins - game.coins)
+
+    def counted_check_collision(game, fireballs):
+        source[0] = "fireball"
+        try:
+            check_collision(game, fireballs)
+        finally:
+            source[0] = "trap"
+
+    game_logic.take_damage = counted_take_damage
+    game_logic.take_damage_monster = counted_take_damage_monster
+    game_logic.check_collision = counted_check_collision
+
+def add_damage(source, points):
+    if points > 0:
+        damage_taken[source] = damage_taken.get(source, 0) + points
+
+
+#
+# agents, they return the direction to move for the next tick
+#
+
+def random_agent(game, rng):
+    return rng.choice(DIRECTIONS + [None])
+
+def seek_agent(game, rng):
+    if rng.random() < SEEK_RANDOM:
+        return rng.choice(DIRECTIONS)
+    level = game.current_level.level
+    has_key = "key" in game.items
+    goals = {ord("x")}
+    if not has_key:
+        goals.add(ord("k"))     # the stairs may be behind a closed door
+    step = first_step(level, game.x, game.y, goals, has_key)
+    return step if step is not None else rng.choice(DIRECTIONS)
+
+def first_step(level, x, y, goals, has_key):
+    # breadth-first search to the nearest goal tile, returns the first direction on the way
+    height, width = level.shape
+    seen = {(x, y): None}
+    queue = deque([(x, y)])
+    while queue:
+        cx, cy = queue.popleft()
+        for direction, (dx, dy) in zip(DIRECTIONS, NEIGHBOURS):
+            nx, ny = cx + dx, cy + dy
+            if not (0 <= nx < width and 0 <= ny < height) or (nx, ny) in seen:
+                continue
+            tile = level[ny, nx]
+            seen[(nx, ny)] = direction if (cx, cy) == (x, y) else seen[(cx, cy)]
+            if tile in goals:
+                return seen[(nx, ny)]
+            if WALKABLE[tile] or (tile == ord("d") and has_key):
+                queue.append((nx, ny))
+    return None
+
+AGENTS = {"random": random_agent, "seek": seek_agent}
+
+
+#
+# workers
+#
+
+def start_worker(templates):
+    # the level templates of the parent process, no level is read from disk again
+    for name, template in templates.items():
+        level_cache.add(name, template)
+    instrument()
+
+def play(level_number, agent, seed, max_ticks=MAX_TICKS):
+    """Plays one level once. Returns the outcome, ticks, coins and damage by source."""
+    damage_taken.clear()
+    level = LEVELS[level_number].instance()
+    game = DungeonGame(current_level=level, level_number=level_number,
+                       x=level.spawn[0], y=level.spawn[1], seed=seed)
+    rng = random.Random(seed)
+    choose = AGENTS[agent]
+    outcome = "timeout"
+    ticks = 0
+    while ticks < max_ticks:
+        tick(game, choose(game, rng) if not game_logic.is_player_moving(game.moves) else None)
+        ticks += 1
+        if game.status == "game over":
+            outcome = "died"
+            break
+        if game.level_number != level_number or game.status == "finished":
+            outcome = "stairs"
+            break
+        if game.current_level is not level:
+            outcome = "secret"
+            break
+    return {"outcome": outcome, "ticks": ticks, "coins": game.coins, "damage": dict(damage_taken)}
+
+def play_batch(level_number, agent, seeds, max_ticks=MAX_TICKS):
+    return level_number, agent, [play(level_number, agent, seed, max_ticks) for seed in seeds]
+
+def play_seeds(seed, level_number, agent, plays):
+    # a different game seed for every play, the same for the same arguments
+    sequence = np.random.SeedSequence([seed, level_number, list(AGENTS).index(agent)])
+    return sequence.generate_state(plays, np.uint64).tolist()
+
+
+#
+# results
+#
+
+class LevelStats:
+    """The plays of one level by one agent, added as they finish."""
+
+    def __init__(self):
+        self.plays = 0
+        self.outcomes = {}
+        self.damage = {}
+        self.coins = 0
+        self.stairs_ticks = []
+
+    def add(self, result):
+        self.plays += 1
+        self.outcomes[result["outcome"]] = self.outcomes.get(result["outcome"], 0) + 1
+        for source, points in result["damage"].items():
+            self.damage[source] = self.damage.get(source, 0) + points
+        self.coins += result["coins"]
+        if result["outcome"] == "stairs":
+            self.stairs_ticks.append(result["ticks"])
+
+    def summary(self):
+        ticks = np.array(self.stairs_ticks)
+        return {
+            "plays": self.plays,
+            "survival_rate": 1 - self.outcomes.get("died", 0) / self.plays,
+            "stairs_rate": self.outcomes.get("stairs", 0) / self.plays,
+            "outcomes": dict(sorted(self.outcomes.items())),
+            "damage_per_play": {source: points / self.plays for source, points in sorted(self.damage.items())},
+            "coins_per_play": self.coins / self.plays,
+            "ticks_to_stairs": {
+                "median": float(np.median(ticks)),
+                "p10": float(np.percentile(ticks, 10)),
+                "p90": float(np.percentile(ticks, 90)),
+            } if len(ticks) else None,
+        }
+
+def print_report(stats):
+    print(f"{'level':6s} {'agent':7s} {'plays':>6s} {'survive':>8s} {'stairs':>7s} "
+          f"{'coins':>6s} {'ticks p50':>9s}  damage per play")
+    for (level_number, agent), s in sorted(stats.items()):
+        summary = s.summary()
+        ticks = summary["ticks_to_stairs"]
+        damage = ", ".join(f"{source} {points:.2f}" for source, points in summary["damage_per_play"].items())
+        print(f"{level_number + 1:<6d} {agent:7s} {summary['plays']:>6d} {summary['survival_rate']:>8.1%} "
+              f"{summary['stairs_rate']:>7.1%} {summary['coins_per_play']:>6.2f} "
+              f"{ticks['median'] if ticks else float('nan'):>9.0f}  {damage or '-'}")
+
+
+def run(levels, agents, plays, seed=0, workers=None, max_ticks=MAX_TICKS, progress=True):
+    """
+    Plays every level in levels (indices into LEVELS) plays times with every agent.
+    Returns (level index, agent) -> LevelStats.
+    """
+    # parse every template once, here, and hand them to the workers
+    templates = {name: LEVELS.cache.get(name) for name in LEVELS.names + SECRET_LEVELS.names}
+    stats = {(level_number, agent): LevelStats() for level_number in levels for agent in agents}
+    total = len(stats) * plays
+    done = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=start_worker, initargs=(templates,)) as pool:
+        futures = []
+        for level_number in levels:
+            for agent in agents:
+                seeds = play_seeds(seed, level_number, agent, plays)
+                for i in range(0, plays, BATCH_SIZE):
+                    futures.append(pool.submit(play_batch, level_number, agent, seeds[i:i + BATCH_SIZE], max_ticks))
+        for future in as_completed(futures):
+            level_number, agent, results = future.result()
+            for result in results:
+                stats[(level_number, agent)].add(result)
+            done += len(results)
+            if progress:
+                print(f"\r{done}/{total} plays, {time.perf_counter() - start:.1f}s", end="", file=sys.stderr)
+    if progress:
+        print(file=sys.stderr)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play the levels many times and report how hard they are.")
+    parser.add_argument("--plays", type=int, default=1000, help="plays per level and agent")
+    parser.add_argument("--agent", nargs="+", default=list(AGENTS), choices=list(AGENTS))
+    parser.add_argument("--levels", nargs="+", type=int, default=None, help="level numbers, from 1 (default: all)")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per core)")
+    parser.add_argument("--max-ticks", type=int, default=MAX_TICKS, help="a play ends after this many ticks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="also write the summaries to this file")
+    args = parser.parse_args(argv)
+
+    levels = [n - 1 for n in args.levels] if args.levels else list(range(len(LEVELS)))
+    for n in levels:
+        if not 0 <= n < len(LEVELS):
+            parser.error(f"there is no level {n + 1}")
+    stats = run(levels, args.agent, args.plays, args.seed, args.workers, args.max_ticks)
+    print_report(stats)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([{"level": level_number + 1, "agent": agent, **s.summary()}
+                       for (level_number, agent), s in sorted(stats.items())], f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+"""
+benchmarks for the hot paths of the game
+
+    python -m benchmarks                    # run all, write benchmarks/results.json
+    python -m benchmarks --save-baseline    # ...and store them as the baseline
+    python -m benchmarks --quick -k draw    # fewer samples, only names containing "draw"
+
+Every run is compared against benchmarks/baseline.json if it exists.
+OpenCV window calls are stubbed, so no display is needed.
+"""
@@ -0,0 +1,277 @@
+"""
+runs the benchmarks, writes the results as JSON and compares them with a baseline
+
+Every benchmark is a list of samples in nanoseconds, summarized as
+median, mean, min and 95th percentile in microseconds. Regressions are
+judged by the median, which is the least noisy of them.
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.path.join(ROOT, "benchmarks", "results.json")
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+RESULTS_VERSION = 1
+
+
+def stub_windows():
+    # no display on a build machine, drawing into the frame is what gets measured
+    cv2.imshow = lambda *args: None
+    cv2.namedWindow = lambda *args, **kwargs: None
+    cv2.setWindowProperty = lambda *args, **kwargs: None
+    cv2.destroyAllWindows = lambda *args: None
+    cv2.waitKey = lambda delay=0: -1
+
+
+def summarize(samples):
+    samples = np.asarray(samples, np.float64) / 1000
+    return {
+        "median_us": round(float(np.median(samples)), 3),
+        "mean_us": round(float(samples.mean()), 3),
+        "min_us": round(float(samples.min()), 3),
+        "p95_us": round(float(np.percentile(samples, 95)), 3),
+        "samples": len(samples),
+    }
+
+
+#
+# benchmarks
+#
+
+def benchmark_levels(quick):
+    # name -> level template, the campaign and the synthetic stress levels
+    from levels import LEVELS
+    from benchmarks.stress import STRESS_LEVELS, stress_level
+    levels = {f"level{i + 1}": level for i, level in enumerate(LEVELS)}
+    for name, size in STRESS_LEVELS.items():
+        if quick and name == "stress_160x120":
+            continue
+        levels[name] = stress_level(*size)
+    return levels
+
+def new_game(template):
+    from game import DungeonGame
+    level = template.instance()
+    # cannot die, so every tick is spent on the same level
+    return DungeonGame(current_level=level, x=level.spawn[0], y=level.spawn[1], seed=0, health=10**9)
+
+def keep_on_level(game, level):
+    # stairs and teleporters must not take the benchmark to another level
+    if game.current_level is not level or game.status != "running":
+        game.current_level = level
+        game.x, game.y = level.spawn
+        game.status = "running"
+        game.moves.clear()
+
+def bench_simulation(template, ticks):
+    """Times update(), clean_moves() and move_player() while random walking for ticks ticks."""
+    from game import advance_moves, update, clean_moves, move_player, is_player_moving, DIRECTIONS
+    from entities import level_entities
+    game = new_game(template)
+    level = game.current_level
+    rng = random.Random(0)
+    samples = {"update": [], "clean_moves": [], "move_player": []}
+    clock = time.perf_counter_ns
+    for _ in range(ticks):
+        entities = level_entities(game.current_level)
+        advance_moves(game, entities)
+        t0 = clock()
+        update(game, entities)
+        t1 = clock()
+        clean_moves(game, entities)
+        t2 = clock()
+        samples["update"].append(t1 - t0)
+        samples["clean_moves"].append(t2 - t1)
+        if not is_player_moving(game.moves):
+            direction = rng.choice(DIRECTIONS)
+            t0 = clock()
+            move_player(game, direction)
+            samples["move_player"].append(clock() - t0)
+        keep_on_level(game, level)
+    return samples
+
+def bench_draw(template, images, frames, repeat):
+    """
+    Times the first draw on a new instance of the level, which renders the
+    background, and then one draw per tick.
+    """
+    import main
+    from game import tick, DIRECTIONS
+    clock = time.perf_counter_ns
+    new_level = []
+    for _ in range(repeat):
+        game = new_game(template)
+        t0 = clock()
+        main.draw(game, images)
+        new_level.append(clock() - t0)
+
+    level = game.current_level
+    rng = random.Random(0)
+    samples = []
+    for _ in range(frames):
+        tick(game, rng.choice(DIRECTIONS))
+        keep_on_level(game, level)
+        t0 = clock()
+        main.draw(game, images, alpha=0.5)
+        samples.append(clock() - t0)
+    return {"draw_new_level": new_level, "draw": samples}
+
+def bench_read_images(repeat):
+    import main
+    import image_cache
+    warm = []
+    cold = []
+    main.read_images()      # make sure the cache exists
+    for _ in range(repeat):
+        t0 = time.perf_counter_ns()
+        main.read_images()
+        warm.append(time.perf_counter_ns() - t0)
+    # an empty cache directory, every tile is decoded and the bundle written
+    cache_path = image_cache.CACHE_PATH
+    try:
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as tmp:
+                image_cache.CACHE_PATH = tmp
+                t0 = time.perf_counter_ns()
+                main.read_images()
+                cold.append(time.perf_counter_ns() - t0)
+    finally:
+        image_cache.CACHE_PATH = cache_path
+    return {"read_images": warm, "read_images_cold": cold}
+
+def bench_generate(width, height, repeat):
+    from generator import generate_level
+    samples = []
+    for seed in range(repeat):
+        t0 = time.perf_counter_ns()
+        generate_level(seed, width, height)
+        samples.append(time.perf_counter_ns() - t0)
+    return samples
+
+def bench_import(repeat):
+    # a fresh interpreter each time, only the import itself is timed
+    code = "import time; t = time.perf_counter_ns(); import game; print(time.perf_counter_ns() - t)"
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        samples.append(int(output.split()[-1]))
+    return samples
+
+
+def run(quick=False, pattern=None):
+    """Runs all benchmarks whose name contains pattern. Returns name -> summary."""
+    stub_windows()
+    ticks = 500 if quick else 3000
+    frames = 30 if quick else 200
+    repeat = 3 if quick else 10
+    selected = lambda name: pattern is None or pattern in name
+    results = {}
+
+    def add(name, samples):
+        if samples and selected(name):
+            results[name] = summarize(samples)
+            print(f"{name:40s} {results[name]['median_us']:>12.1f} us", file=sys.stderr)
+
+    if selected("import"):
+        add("import_game", bench_import(repeat))
+    if selected("read_images"):
+        for name, samples in bench_read_images(repeat).items():
+            add(name, samples)
+
+    for width, height in ((41, 31), (1001, 1001)):
+        if selected(f"generate/{width}x{height}"):
+            add(f"generate/{width}x{height}", bench_generate(width, height, repeat))
+
+    import main
+    images = main.read_images()
+    for level_name, template in benchmark_levels(quick).items():
+        if any(selected(f"{kind}/{level_name}") for kind in ("update", "clean_moves", "move_player")):
+            for kind, samples in bench_simulation(template, ticks).items():
+                add(f"{kind}/{level_name}", samples)
+        if selected(f"draw/{level_name}") or selected(f"draw_new_level/{level_name}"):
+            for kind, samples in bench_draw(template, images, frames, repeat).items():
+                add(f"{kind}/{level_name}", samples)
+    return results
+
+
+#
+# results and baseline
+#
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "system": platform.system(),
+    }
+
+def write_results(path, results):
+    with open(path, "w") as f:
+        json.dump({"version": RESULTS_VERSION, "meta": metadata(), "results": results}, f, indent=1)
+
+def read_results(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+def compare(results, baseline, threshold):
+    """
+    Prints the change of every median against the baseline.
+    Returns the names that got slower by more than threshold (0.1 = 10%).
+    """
+    regressions = []
+    print(f"{'benchmark':40s} {'baseline':>12s} {'now':>12s} {'change':>8s}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:40s} {'-':>12s} {result['median_us']:>12.1f}")
+            continue
+        before = baseline[name]["median_us"]
+        now = result["median_us"]
+        change = now / before - 1 if before else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:40s} {before:>12.1f} {now:>12.1f} {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmark the game's hot paths.")
+    parser.add_argument("-k", dest="pattern", default=None, help="only run benchmarks whose name contains this")
+    parser.add_argument("--quick", action="store_true", help="fewer samples and no huge stress level")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="also store the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run(args.quick, args.pattern)
+    write_results(args.output, results)
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        regressions = compare(results, read_results(args.baseline), args.threshold)
+    if args.save_baseline:
+        write_results(args.baseline, results)
+        print(f"baseline saved to {args.baseline}")
+    return 1 if regressions else 0
@@ -0,0 +1,51 @@
+"""
+synthetic levels with many monsters and fireballs, for benchmarking
+"""
+import numpy as np
+
+from levels import Level, Monster, Fireball, DIRECTIONS
+
+MONSTER_TYPES = ["rat", "giant", "skeleton", "spider", "snake"]
+BEHAVIORS = ["wander", "chase", "flee"]
+
+# name -> (width, height, monsters, fireballs)
+STRESS_LEVELS = {
+    "stress_32x24": (32, 24, 50, 25),
+    "stress_64x48": (64, 48, 300, 150),
+    "stress_160x120": (160, 120, 2000, 1000),
+}
+
+
+def stress_level(width, height, monsters, fireballs, seed=0):
+    """
+    A walled level with scattered walls and coins and the given number of
+    monsters (wandering, chasing and fleeing) and fireballs on random floor
+    cells. The same seed gives the same level.
+    """
+    rng = np.random.default_rng(seed)
+    grid = np.full((height, width), ord("."), np.uint8)
+    inner = rng.random((height - 2, width - 2))
+    grid[1:-1, 1:-1][inner < 0.15] = ord("#")
+    grid[1:-1, 1:-1][(inner >= 0.15) & (inner < 0.18)] = ord("$")
+    grid[[0, -1], :] = ord("#")
+    grid[:, [0, -1]] = ord("#")
+    grid[1, 1] = ord(".")       # spawn
+
+    floor = np.argwhere(grid == ord("."))
+    floor = floor[(floor[:, 0] != 1) | (floor[:, 1] != 1)]
+    cells = floor[rng.choice(len(floor), monsters + fireballs, replace=False)].tolist()
+    directions = rng.integers(4, size=len(cells)).tolist()
+    return Level(
+        level=grid,
+        title=f"Stress {width}x{height}",
+        spawn=[1, 1],
+        monsters=[
+            Monster(type=MONSTER_TYPES[i % len(MONSTER_TYPES)], x=x, y=y, direction=DIRECTIONS[d], speed=1,
+                    behavior=BEHAVIORS[i % len(BEHAVIORS)])
+            for i, ((y, x), d) in enumerate(zip(cells[:monsters], directions))
+        ],
+        fireballs=[
+            Fireball(x=x, y=y, direction=DIRECTIONS[d], speed=1)
+            for (y, x), d in zip(cells[monsters:], directions[monsters:])
+        ],
+    )
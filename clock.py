@@ -0,0 +1,64 @@
+"""
+fixed-timestep clock for the main loop
+
+The game logic always advances in ticks of the same length, no matter how
+fast the machine renders. Real time is collected in an accumulator and
+spent in whole ticks; the remainder (alpha) is used to interpolate drawing.
+"""
+import time
+
+TICK_RATE = 60          # logic ticks per second
+MAX_TICKS_PER_FRAME = 8 # when further behind, the game slows down instead of freezing
+MAX_FRAME_SKIP = 4      # frames skipped in a row while behind before one is drawn anyway
+
+
+class FixedTimestep:
+
+    def __init__(self, tick_rate=TICK_RATE, max_ticks_per_frame=MAX_TICKS_PER_FRAME,
+                 max_frame_skip=MAX_FRAME_SKIP, clock=time.perf_counter):
+        self.dt = 1.0 / tick_rate
+        self.max_ticks_per_frame = max_ticks_per_frame
+        self.max_frame_skip = max_frame_skip
+        self.clock = clock
+        self.last = clock()
+        self.accumulator = 0.0
+        self.skipped = 0
+
+    def ticks(self):
+        """Returns how many logic ticks are due since the last call."""
+        now = self.clock()
+        self.accumulator += now - self.last
+        self.last = now
+        due = int(self.accumulator / self.dt)
+        if due > self.max_ticks_per_frame:
+            # drop the time we cannot catch up with
+            due = self.max_ticks_per_frame
+            self.accumulator = due * self.dt
+        self.accumulator -= due * self.dt
+        return due
+
+    def tick_time(self, index, due):
+        """The clock time at which tick index of the due ticks returned by ticks() became due."""
+        return self.last - self.accumulator - (due - 1 - index) * self.dt
+
+    @property
+    def alpha(self):
+        """How far the clock is into the next tick, between 0 and 1."""
+        return min(self.accumulator / self.dt, 1.0)
+
+    def behind(self):
+        # more than one tick is already waiting again
+        return self.accumulator + (self.clock() - self.last) >= self.dt
+
+    def should_draw(self):
+        """False while the loop is behind, at most max_frame_skip times in a row."""
+        if self.behind() and self.skipped < self.max_frame_skip:
+            self.skipped += 1
+            return False
+        self.skipped = 0
+        return True
+
+    def wait_ms(self):
+        """Milliseconds until the next tick is due, at least 1 for cv2.waitKey."""
+        remaining = self.dt - self.accumulator - (self.clock() - self.last)
+        return max(1, int(remaining * 1000))
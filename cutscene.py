@@ -1,9 +1,21 @@
+import os
 import cv2
 import time
+import image_cache
+
+SCREEN_PATH = os.path.split(__file__)[0]
+
+def read_screen(name):
+    # returns a copy of a cached background image, the cutscenes draw on it
+    screens = image_cache.load_images("screens", {
+        "title": os.path.join(SCREEN_PATH, "title.png"),
+        "gameover": os.path.join(SCREEN_PATH, "gameover.png"),
+    })
+    return screens[name].copy()
 
 # title screen
 def show_titlescreen():
-    img = cv2.imread("title.png")
+    img = read_screen("title")
     img[-150:] = 0  # last 100 pixel rows are black
     img = cv2.putText(
         img,
@@ -34,7 +46,7 @@ def show_titlescreen():
         cv2.destroyAllWindows() # destroy window for game to be shown
 
 def show_instructions():
-    img = cv2.imread("gameover.png") # background image (black)
+    img = read_screen("gameover") # background image (black)
     centerText("Find the stairs to complete each level.", cv2.FONT_HERSHEY_SIMPLEX, 3, 2, (255, 255, 255), img, 0, -400)
     centerText("Search the levels to find useful items.", cv2.FONT_HERSHEY_SIMPLEX, 3, 2, (255, 255, 255), img, 0, -300)
     centerText("Avoid enemies during your adventure!", cv2.FONT_HERSHEY_SIMPLEX, 3, 2, (255, 255, 255), img, 0, -200)
@@ -48,7 +60,7 @@ def show_instructions():
 
 # game complete screen
 def game_complete():
-    img = cv2.imread("gameover.png") # background image (black)
+    img = read_screen("gameover") # background image (black)
     centerText("Game Complete!", cv2.FONT_HERSHEY_SIMPLEX, 5, 2, (255, 255, 255), img, 0, 0) # center text
     centerText("Press Any Key to Close", cv2.FONT_HERSHEY_SIMPLEX, 2, 2, (255, 255, 255), img, 0, 200)
     cv2.imshow("Congrats!", img)
@@ -57,7 +69,7 @@ def game_complete():
 
 # game over screen
 def show_gameover():
-    img = cv2.imread("gameover.png") # background image (black)
+    img = read_screen("gameover") # background image (black)
     centerText("Game Over!", cv2.FONT_HERSHEY_SIMPLEX, 5, 2, (255, 255, 255), img, 0, 0) # center text
     centerText("Press Any Key to Close", cv2.FONT_HERSHEY_SIMPLEX, 2, 2, (255, 255, 255), img, 0, 200)
     cv2.imshow("Game Over!", img)
@@ -80,7 +92,7 @@ def align(text, fontFace, fontScale, thickness, color, img, side, alignment, off
 
 # quit screen - stub
 def quit_game():
-    img = cv2.imread("gameover.png") # background image (black)
+    img = read_screen("gameover") # background image (black)
     centerText("Quitting Game...", cv2.FONT_HERSHEY_SIMPLEX, 5, 2, (255, 255, 255), img, 0, 0) # center text
     cv2.imshow("Quit Game", img)
     time.sleep(5)
@@ -0,0 +1,155 @@
+"""
+the fireballs and monsters of a level as arrays
+
+An EntityGroup keeps the position, direction, speed and move of every
+fireball or monster of a level in numpy arrays. A tick proposes the next
+cell of everything that stands still, tests it against the grid, starts
+the moves or turns around at walls, and finds what stands on the player
+with a few array operations, however many entities there are.
+
+The objects in level.fireballs and level.monsters are still what is saved,
+rewound and looked up with Level.at(). Only the entities that start a move
+or turn in a tick are written back to them, a small part of all of them.
+
+A move of an entity works like a move in moves.py: it starts on the cell
+the entity leaves and is complete after travelling one tile.
+"""
+import numpy as np
+
+from moves import TILE_SIZE
+from levels import DIRECTIONS, NEIGHBOURS
+
+DX = np.array([dx for dx, dy in NEIGHBOURS], np.int32)      # by direction code
+DY = np.array([dy for dx, dy in NEIGHBOURS], np.int32)
+REVERSE = np.array([1, 0, 3, 2], np.int8)
+
+
+class EntityGroup:
+
+    def __init__(self, entities, tiles):
+        self.entities = list(entities)
+        self.tiles = tiles                  # name of the tile image of every entity
+        self.slot = {id(e): i for i, e in enumerate(self.entities)}
+        count = len(self.entities)
+        self.x = np.fromiter((e.x for e in self.entities), np.int32, count)
+        self.y = np.fromiter((e.y for e in self.entities), np.int32, count)
+        self.direction = np.fromiter((DIRECTIONS.index(e.direction) for e in self.entities), np.int8, count)
+        self.speed = np.fromiter((e.speed for e in self.entities), np.int32, count)
+        # the current move, x and y are already the cell it goes to
+        self.moving = np.zeros(count, bool)
+        self.running = 0                    # how many are moving, most ticks none or all of a small group
+        self.progress = np.zeros(count, np.int32)
+        self.from_x = self.x.copy()
+        self.from_y = self.y.copy()
+        self.everyone = np.arange(count)
+
+    def __len__(self):
+        return len(self.entities)
+
+    def is_moving(self, entity):
+        return bool(self.moving[self.slot[id(entity)]])
+
+    def idle(self):
+        # indices of the entities that stand still
+        if not self.running:
+            return self.everyone
+        return np.flatnonzero(~self.moving)
+
+    def next_cells(self, index, direction):
+        # the cells next to the entities in index, in the given directions
+        return self.x[index] + DX[direction], self.y[index] + DY[direction]
+
+    def start(self, level, index, x, y):
+        """Starts moves of the entities in index to the cells x, y."""
+        self.from_x[index] = self.x[index]
+        self.from_y[index] = self.y[index]
+        self.x[index] = x
+        self.y[index] = y
+        self.moving[index] = True
+        self.progress[index] = 0
+        self.running += len(index)
+        for i, new_x, new_y in zip(index.tolist(), x.tolist(), y.tolist()):
+            level.move_entity(self.entities[i], new_x, new_y)
+
+    def turn(self, index, direction):
+        self.direction[index] = direction
+        for i, d in zip(index.tolist(), direction.tolist()):
+            self.entities[i].direction = DIRECTIONS[d]
+
+    def advance(self):
+        if self.running:
+            self.progress += self.moving
+
+    def retire(self):
+        # moves are complete after travelling a whole tile
+        if self.running:
+            self.moving &= self.progress * self.speed < TILE_SIZE
+            self.running = int(np.count_nonzero(self.moving))
+
+    def standing_at(self, x, y):
+        if self.running == len(self.entities):      # nobody stands, or there is nobody
+            return self.everyone[:0]
+        return np.flatnonzero(~self.moving & (self.x == x) & (self.y == y))
+
+    def visible(self, x0, y0, x1, y1):
+        """
+        Returns the indices of the entities standing on x0 <= x < x1, y0 <= y < y1
+        and of the moving ones that may be seen there, a move stays within
+        one tile of where it started.
+        """
+        moving = self.moving
+        standing = ~moving & (self.x >= x0) & (self.x < x1) & (self.y >= y0) & (self.y < y1)
+        moving = (moving & (self.from_x >= x0 - 1) & (self.from_x <= x1)
+                  & (self.from_y >= y0 - 1) & (self.from_y <= y1))
+        return np.flatnonzero(standing), np.flatnonzero(moving)
+
+    def pixel_positions(self, index, alpha=0.0):
+        """
+        Returns the pixel positions in the level of the moving entities in index,
+        like moves.move_position().
+        """
+        offset = np.minimum((self.progress[index] + alpha) * self.speed[index], TILE_SIZE).astype(np.int32)
+        direction = self.direction[index]
+        return (self.from_x[index] * TILE_SIZE + DX[direction] * offset,
+                self.from_y[index] * TILE_SIZE + DY[direction] * offset)
+
+    def positions(self):
+        # x, y and direction code of every entity
+        return np.column_stack((self.x, self.y, self.direction)).astype(np.int32)
+
+
+class LevelEntities:
+    """The fireballs and monsters of one level instance."""
+
+    def __init__(self, level):
+        self.fireballs = EntityGroup(level.fireballs, ["fireball"] * len(level.fireballs))
+        self.monsters = EntityGroup(level.monsters, [m.type for m in level.monsters])
+        self.wander = np.fromiter((m.behavior == "wander" for m in level.monsters), bool, len(level.monsters))
+
+    def advance(self):
+        self.fireballs.advance()
+        self.monsters.advance()
+
+    def retire(self):
+        self.fireballs.retire()
+        self.monsters.retire()
+
+    def count_moving(self):
+        return self.fireballs.running + self.monsters.running
+
+    def positions(self):
+        # all fireballs followed by all monsters, like rewind.entity_positions()
+        return np.concatenate((self.fireballs.positions(), self.monsters.positions()))
+
+
+def level_entities(level):
+    """
+    Returns the entity arrays of a level, made from its fireballs and
+    monsters the first time. Drop them with level.entities = None when the
+    objects were changed some other way, e.g. by rewinding.
+    """
+    entities = level.entities
+    if entities is None:
+        entities = LevelEntities(level)
+        level.entities = entities
+    return entities
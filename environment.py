@@ -0,0 +1,203 @@
+"""
+the game as an environment for bots
+
+DungeonEnv plays the real game rules of game.py without drawing anything:
+reset() starts a game, step(action) moves the player and returns what the
+bot sees as integer arrays instead of pixels:
+
+    observation  int16 array (CHANNELS, height, width), one plane per channel:
+        TERRAIN      character code of the tile, '#' outside the level
+        MONSTERS     1 + index of the monster type in MONSTER_TYPES, 0 if none,
+                     len(MONSTER_TYPES) + 1 for a type not in the list
+        FIREBALLS    1 where a fireball is
+        CHESTS       1 where a closed chest is
+        TELEPORTERS  1 where a teleporter is
+        PLAYER       1 on the player's cell
+    stats        int32 vector of STATS: health, armor, coins, player_state
+                 (index in PLAYER_STATES) and keys
+
+Both are allocated once and filled in place on every step, so the arrays
+returned are the same objects each time; copy them to keep an observation.
+Monsters and fireballs are written straight from the arrays in entities.py.
+
+BatchedEnv steps many environments with one call and returns all their
+observations in one (count, CHANNELS, height, width) array.
+
+    env = DungeonEnv(seed=1)
+    observation, stats = env.reset()
+    observation, stats, reward, done = env.step(UP)
+"""
+import numpy as np
+
+from game import DungeonGame, tick, is_player_moving, hit_points, PLAYER_STATES
+from levels import LEVELS, SECRET_LEVELS
+from entities import level_entities
+
+TERRAIN, MONSTERS, FIREBALLS, CHESTS, TELEPORTERS, PLAYER = range(6)
+CHANNELS = 6
+STATS = ["health", "armor", "coins", "player_state", "keys"]
+# the codes of the MONSTERS channel, new types go at the end so the codes of the others stay the same
+MONSTER_TYPES = ["rat", "giant", "skeleton", "spider", "snake", "bat", "slime", "undead"]
+
+# actions
+WAIT, UP, DOWN, LEFT, RIGHT = range(5)
+ACTIONS = [None, "up", "down", "left", "right"]
+
+# reward for the changes of one step
+REWARDS = {"coin": 1.0, "stairs": 10.0, "damage": -1.0, "death": -10.0}
+
+MAX_TICKS = 20000       # an episode ends after this many ticks
+MAX_STEP_TICKS = 64     # a step never runs longer than this, even if the player stays in a move
+
+
+def campaign_size():
+    # height and width of the largest level of the campaign
+    shapes = [level.level.shape for level in list(LEVELS) + list(SECRET_LEVELS)]
+    return max(h for h, w in shapes), max(w for h, w in shapes)
+
+
+class DungeonEnv:
+
+    def __init__(self, level_number=0, size=None, seed=None, max_ticks=MAX_TICKS,
+                 observation=None, stats=None):
+        """
+        Plays LEVELS from level_number on. The observation has size
+        (height, width), the largest level of the campaign by default.
+        observation and stats can be given to fill existing arrays, see BatchedEnv.
+        """
+        height, width = size if size is not None else campaign_size()
+        self.level_number = level_number
+        self.seed = seed
+        self.max_ticks = max_ticks
+        self.observation = observation if observation is not None else np.zeros((CHANNELS, height, width), np.int16)
+        self.stats = stats if stats is not None else np.zeros(len(STATS), np.int32)
+        self.game = None
+        self.level = None           # the level the static channels were written for
+        self.monster_types = None   # MONSTERS value of every monster of that level
+        self.ticks = 0
+        self.episodes = 0
+
+    def reset(self, seed=None):
+        """Starts a new game. Returns the observation and the stats."""
+        if seed is None and self.seed is not None:
+            seed = self.seed + self.episodes    # every episode of a seeded environment differs
+        level = LEVELS[self.level_number].instance()
+        self.game = DungeonGame(current_level=level, level_number=self.level_number,
+                                x=level.spawn[0], y=level.spawn[1],
+                                **({} if seed is None else {"seed": seed}))
+        self.level = None
+        self.ticks = 0
+        self.episodes += 1
+        self.observe()
+        return self.observation, self.stats
+
+    def step(self, action):
+        """
+        Moves the player in the direction of action (WAIT, UP, DOWN, LEFT or
+        RIGHT) and runs the game until it can move again.
+        Returns the observation, the stats, the reward and whether the episode ended.
+        """
+        game = self.game
+        before = (game.coins, hit_points(game), game.level_number)
+        tick(game, ACTIONS[action])
+        ticks = 1
+        while is_player_moving(game.moves) and game.status == "running" and ticks < MAX_STEP_TICKS:
+            tick(game, None)
+            ticks += 1
+        self.ticks += ticks
+        self.observe()
+        done = game.status != "running" or self.ticks >= self.max_ticks
+        return self.observation, self.stats, self.reward(before), done
+
+    def reward(self, before):
+        game = self.game
+        coins, hit_points_before, level_number = before
+        reward = REWARDS["coin"] * max(game.coins - coins, 0)
+        reward += REWARDS["damage"] * max(hit_points_before - hit_points(game), 0)
+        if game.level_number > level_number or game.status == "finished":
+            reward += REWARDS["stairs"]
+        if game.status == "game over":
+            reward += REWARDS["death"]
+        return reward
+
+    def observe(self):
+        # fill the observation and the stats in place
+        game = self.game
+        level = game.current_level
+        observation = self.observation
+        if level is not self.level:
+            self.new_level(level)
+        height, width = level.level.shape
+        np.copyto(observation[TERRAIN, :height, :width], level.level)
+
+        entities = level_entities(level)
+        observation[MONSTERS:TELEPORTERS].fill(0)
+        observation[PLAYER].fill(0)
+        monsters, fireballs = entities.monsters, entities.fireballs
+        observation[MONSTERS, monsters.y, monsters.x] = self.monster_types
+        observation[FIREBALLS, fireballs.y, fireballs.x] = 1
+        for c in level.chests:
+            if not c.opened:
+                observation[CHESTS, c.y, c.x] = 1
+        observation[PLAYER, game.y, game.x] = 1
+
+        stats = self.stats
+        stats[0] = game.health
+        stats[1] = game.armor_health if game.armor_worn else 0
+        stats[2] = game.coins
+        stats[3] = PLAYER_STATES.index(game.player_state)
+        stats[4] = game.items.count("key")
+
+    def new_level(self, level):
+        # the channels that only change with the level
+        height, width = level.level.shape
+        observation = self.observation
+        if height > observation.shape[1] or width > observation.shape[2]:
+            raise ValueError(f"Level {level.title!r} is {width}x{height}, "
+                             f"larger than the observation ({observation.shape[2]}x{observation.shape[1]})")
+        observation[TERRAIN].fill(ord("#"))
+        observation[TELEPORTERS].fill(0)
+        for t in level.teleporters:
+            observation[TELEPORTERS, t.y, t.x] = 1
+        self.monster_types = np.array([MONSTER_TYPES.index(m.type) + 1 if m.type in MONSTER_TYPES
+                                       else len(MONSTER_TYPES) + 1 for m in level.monsters], np.int16)
+        self.level = level
+
+
+class BatchedEnv:
+    """
+    count environments whose observations and stats are slices of one array.
+    An environment whose episode ended is reset by the next step().
+    """
+
+    def __init__(self, count, level_number=0, size=None, seed=None, max_ticks=MAX_TICKS):
+        height, width = size if size is not None else campaign_size()
+        self.observations = np.zeros((count, CHANNELS, height, width), np.int16)
+        self.stats = np.zeros((count, len(STATS)), np.int32)
+        self.rewards = np.zeros(count, np.float32)
+        self.dones = np.zeros(count, bool)
+        self.envs = [
+            DungeonEnv(level_number, (height, width), None if seed is None else seed + i * 1_000_003,
+                       max_ticks, observation=self.observations[i], stats=self.stats[i])
+            for i in range(count)
+        ]
+
+    def __len__(self):
+        return len(self.envs)
+
+    def reset(self):
+        for env in self.envs:
+            env.reset()
+        self.dones.fill(False)
+        return self.observations, self.stats
+
+    def step(self, actions):
+        """
+        Steps every environment with its action.
+        Returns the observations, stats, rewards and dones of all of them.
+        """
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            if self.dones[i]:
+                env.reset()
+            _, _, self.rewards[i], self.dones[i] = env.step(action)
+        return self.observations, self.stats, self.rewards, self.dones
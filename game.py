@@ -2,22 +2,29 @@
 DAN'S DUNGEON GAME LOGIC
 """
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Callable
-from moves import Move      #import the move class
+from moves import MovePool, PLAYER      #import the moves
 import random
+import numpy as np
+import audio
+from profiling import profiler
+from pathfinding import flow_field, UNREACHED
+from entities import level_entities, REVERSE
 
 from levels import Level                                    #import Level class
-from levels import LEVELS, SECRET_LEVELS, level_test        #import the levels themselves
+from levels import WALKABLE, STANDABLE, FIREBALL_PASSABLE, MONSTER_PASSABLE, DIRECTIONS
+from levels import LEVELS, SECRET_LEVELS                    #import the levels themselves, they are read when needed
 
-from pygame import mixer
-mixer.init()
-mixer.music.load("music/dungeon_music_1.mp3")
-mixer.music.play(loops = -1)
+PLAYER_STATES = ["normal", "poison"]
+STATUSES = ["running", "game over", "finished", "exited"]
 
-REVERSE = {'left':'right', 'right':'left', 'up':'down', 'down':'up'}
+def new_seed():
+    return random.randrange(2**63)
 
 class DungeonGame(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     status: str = "running"
     player_state: str = 'normal'
     armor_worn: bool = False
@@ -28,51 +35,53 @@ class DungeonGame(BaseModel):
     secret_level_number: int = 0
     x: int
     y: int
-    moves: list[Move] = []
+    moves: MovePool = Field(default_factory=MovePool, exclude=True)   # animations are not saved
     coins: int = 0
     health: int = 5
     items: list[str] = []
     hurt_counter: int = 0
+    seed: int = Field(default_factory=new_seed)
+    rng: np.random.Generator = Field(default=None, exclude=True)   # all randomness of the game, made from seed
+
+    def model_post_init(self, context):
+        if self.rng is None:
+            self.rng = np.random.default_rng(self.seed)
 
 def move_player(game, direction: str) -> None:
     # initialize move
-    move = None
+    tile = None
+    finished = None
     
     # WASD movement
     new_x, new_y = get_next_position(game.x, game.y, direction)
     if (new_x - game.x) == 0 and (new_y - game.y) == 0:
         return
-    elif game.current_level.level[new_y][new_x] in "t$wshk.D":
+    elif WALKABLE[game.current_level.level[new_y, new_x]]:
         if game.armor_worn == True:
             tile = 'deep_elf_knight_new'
         else:
             tile = 'player'
-        move = Move(tile = tile,
-                    from_x=game.x,
-                    from_y=game.y,
-                    speed_x = (new_x - game.x) * 15,
-                    speed_y = (new_y - game.y) * 15,
-                    callback = player_move_finished
-                    )
     #print('x: ' + str(new_x), 'y: ' + str(new_y))
     
     # variable for next tile
-    next_tile = game.current_level.level[new_y][new_x]
+    next_tile = game.current_level.tile(new_x, new_y)
 
     # pick up coins
     if next_tile == "$":
         game.current_level.set_tile(x = new_x, y = new_y, character = ".")
         game.coins += 1
+        audio.play("coin")
 
     # trigger trap
     if next_tile == "t":
         game.current_level.set_tile(x = new_x, y = new_y, character = ".")
-        move.finished = take_damage
+        finished = take_damage
+        audio.play("trap")
 
      # trigger healing potion
     if next_tile == "h":
         game.current_level.set_tile(x = new_x, y = new_y, character = ".")
-        move.finished = heal
+        finished = heal
     
     # check for key
     if next_tile == "k":
@@ -83,11 +92,11 @@ def move_player(game, direction: str) -> None:
     if "key" in game.items and next_tile == "d":
         game.items.remove("key")
         game.current_level.set_tile(x = new_x, y = new_y, character = "D")
+        audio.play("door")
 
     # check for chest and add item if there
-    for c in game.current_level.chests:
-        chest_position = [c.x, c.y]
-        if [new_x, new_y] == chest_position and c.opened == False:
+    for c in game.current_level.at("chests", new_x, new_y):
+        if c.opened == False:
             if c.contents == 'armor':
                 if game.armor_worn == True:
                     game.armor_health = 3
@@ -96,6 +105,7 @@ def move_player(game, direction: str) -> None:
             else:
                 game.items.append(c.contents)
             c.opened = True
+            game.current_level.mark_dirty(c.x, c.y)
     
     # check if armor has been removed
     if game.armor_worn == False:
@@ -104,58 +114,67 @@ def move_player(game, direction: str) -> None:
             game.armor_health = 3
     
     # check for tiles that can be walked through
-    if game.current_level.level[new_y][new_x] in ".Dws":
+    if STANDABLE[game.current_level.level[new_y, new_x]]:
+        if tile:
+            game.moves.start(tile = tile,
+                             from_x = game.x,
+                             from_y = game.y,
+                             speed_x = (new_x - game.x) * 15,
+                             speed_y = (new_y - game.y) * 15,
+                             finished = finished,
+                             owner = PLAYER
+                             )
         game.x = new_x
         game.y = new_y
-        if move:                
-            game.moves.append(move)
 
     # teleporter
     check_teleporters(game)
 
     # check for stairs
-    if game.current_level.level[new_y][new_x] == "x":
+    if game.current_level.tile(new_x, new_y) == "x":
+        audio.play("stairs")
         game.level_number += 1
         if game.level_number < len(LEVELS):
-            game.current_level = LEVELS[game.level_number]
+            game.current_level = LEVELS[game.level_number].instance()
             game.x = game.current_level.spawn[0]
             game.y = game.current_level.spawn[1]
+            LEVELS.prefetch(game.level_number + 1)
         else:
             game.status = "finished"
-            mixer.music.stop()
-    elif game.current_level.level[new_y][new_x] == "y":
+            audio.stop_music()
+    elif game.current_level.tile(new_x, new_y) == "y":
+        audio.play("stairs")
         game.secret_level_number += 1
         if game.secret_level_number < len(SECRET_LEVELS):
-            game.current_level = SECRET_LEVELS[game.secret_level_number]
+            game.current_level = SECRET_LEVELS[game.secret_level_number].instance()
             game.x = game.current_level.spawn[0]
             game.y = game.current_level.spawn[1]
+            SECRET_LEVELS.prefetch(game.secret_level_number + 1)
 
     # open secret door 
-    for s in game.current_level.switches:
-        if game.x == s.x and game.y == s.y:
-            if game.current_level.level[s.door_y][s.door_x] == "#":
-                game.current_level.level[s.door_y][s.door_x] = "y"
-                move = Move(tile="wall", 
-                        from_x = s.door_x, from_y = s.door_y, 
-                        speed_x = 0, speed_y = 2
-                    )
-                game.moves.append(move)
-    
-    # check for collision
-    check_collision(game)
-    check_collision_monster(game)
+    for s in game.current_level.at("switches", game.x, game.y):
+        if game.current_level.tile(s.door_x, s.door_y) == "#":
+            game.current_level.set_tile(x = s.door_x, y = s.door_y, character = "y")
+            game.moves.start(tile="wall", 
+                    from_x = s.door_x, from_y = s.door_y, 
+                    speed_x = 0, speed_y = 2
+                )
+
+    # collisions at the new position are checked by the next update()
 
 def player_move_finished(game):
     #outputs the coordinates of the player
     print(game.x, game.y)
 
-def start_game():
-    current_level = LEVELS[0]
-    #current_level = level_test
+def start_game(seed=None):
+    current_level = LEVELS[0].instance()
+    #current_level = read_level("test").instance()
+    LEVELS.prefetch(1)
     return DungeonGame(
         current_level=current_level,
         x=current_level.spawn[0],
         y=current_level.spawn[1],
+        seed=new_seed() if seed is None else seed,
         #level = level_one
     )
 
@@ -199,6 +218,10 @@ def take_damage(game):
         if game.hurt_counter <= 0:
             game.hurt_counter = 100
 
+# health and armor left
+def hit_points(game):
+    return game.health + (game.armor_health if game.armor_worn else 0)
+
 # heal
 def heal(game):
     if game.health < 5:
@@ -213,10 +236,10 @@ def restore(game):
 
 # teleporters
 def check_teleporters(game):
-    for t in game.current_level.teleporters:
-        if game.x == t.x and game.y == t.y:
-            game.x = t.target_x
-            game.y = t.target_y
+    for t in game.current_level.at("teleporters", game.x, game.y):
+        game.x = t.target_x
+        game.y = t.target_y
+        break
 
 # movement
 def get_next_position(x, y, direction):
@@ -232,58 +255,114 @@ def get_next_position(x, y, direction):
         new_y += 1
     return new_x, new_y
 
-# fireball movement
-def move_fireball(game, fireball):
-    new_x, new_y = get_next_position(fireball.x, fireball.y, fireball.direction)
-    if game.current_level.level[new_y][new_x] in "w.$ks":  # flies over coins and keys
-        fireball.move = Move(
-            tile = 'fireball',
-            from_x = fireball.x, from_y = fireball.y, 
-            speed_x = (new_x - fireball.x) * fireball.speed, speed_y = (new_y - fireball.y) * fireball.speed
-        )
-        game.moves.append(fireball.move)
-        fireball.x = new_x
-        fireball.y = new_y            
-    else:
-        fireball.direction = REVERSE[fireball.direction]
-
-# monster movement
-def move_monster(game, monster):
-    monster.direction = random.choice(["up", "down", "left", "right"])
-    new_x, new_y = get_next_position(monster.x, monster.y, monster.direction)
-    if game.current_level.level[new_y][new_x] in "w.s$k":  # moves over coins and keys
-        monster.move = Move(
-            tile = monster.type, 
-            from_x = monster.x, from_y = monster.y, 
-            speed_x = (new_x - monster.x) * monster.speed, speed_y = (new_y - monster.y) * monster.speed
-        )
-        monster.x = new_x
-        monster.y = new_y
-        game.moves.append(monster.move)            
-    else:
-        monster.direction = REVERSE[monster.direction]
+# fireball movement, all fireballs that stand still at once
+def move_fireballs(game, fireballs):
+    idle = fireballs.idle()
+    if len(idle) == 0:
+        return
+    direction = fireballs.direction[idle]
+    new_x, new_y = fireballs.next_cells(idle, direction)
+    free = FIREBALL_PASSABLE[game.current_level.level[new_y, new_x]]  # flies over coins and keys
+    fireballs.start(game.current_level, idle[free], new_x[free], new_y[free])
+    fireballs.turn(idle[~free], REVERSE[direction[~free]])
+
+# chasing and fleeing monsters follow the flow field all monsters of the level share
+def follow_flow(game, monster):
+    flow = flow_field(game.current_level, game.x, game.y)
+    here = flow.distance(monster.x, monster.y)
+    if here == UNREACHED:
+        return DIRECTIONS[game.rng.integers(4)]     # has not noticed the player
+    sign = -1 if monster.behavior == "flee" else 1     # fleeing monsters want to get farther, out of reach is best
+    best = []
+    best_distance = sign * here
+    for direction in DIRECTIONS:
+        x, y = get_next_position(monster.x, monster.y, direction)
+        if not MONSTER_PASSABLE[game.current_level.level[y, x]]:
+            continue
+        distance = sign * flow.distance(x, y)
+        if distance < best_distance:
+            best = [direction]
+            best_distance = distance
+        elif distance == best_distance and best:
+            best.append(direction)
+    if not best:
+        return None
+    if len(best) == 1:
+        return best[0]
+    return best[game.rng.integers(len(best))]
+
+# monster movement, all monsters that stand still at once
+def move_monsters(game, monsters, wander):
+    idle = monsters.idle()
+    if len(idle) == 0:
+        return
+    # wandering monsters pick a random direction, the others follow the flow field
+    wandering = idle[wander[idle]]
+    directions = [game.rng.integers(4, size=len(wandering))]
+    index = [wandering]
+    following = idle[~wander[idle]].tolist()
+    if following:
+        chosen = []
+        for i in following:
+            direction = follow_flow(game, monsters.entities[i])
+            if direction is not None:       # nowhere better to go, wait
+                chosen.append((i, DIRECTIONS.index(direction)))
+        if chosen:
+            i, d = np.array(chosen).T
+            index.append(i)
+            directions.append(d)
+    index = np.concatenate(index)
+    direction = np.concatenate(directions)
+    if len(index) == 0:
+        return
+    new_x, new_y = monsters.next_cells(index, direction)
+    free = MONSTER_PASSABLE[game.current_level.level[new_y, new_x]]  # moves over coins and keys
+    monsters.turn(index, np.where(free, direction, REVERSE[direction]))
+    monsters.start(game.current_level, index[free], new_x[free], new_y[free])
 
 # update fireballs, monsters
-def update(game):
-    check_collision(game)
-    check_collision_monster(game)
-    for f in game.current_level.fireballs:
-        if (f.move and f.move.complete) or (not f.move):
-            move_fireball(game, f)
-    for m in game.current_level.monsters:
-        if (m.move and m.move.complete) or (not m.move):
-            move_monster(game, m)         
+def update(game, entities):
+    check_collision(game, entities.fireballs)
+    check_collision_monster(game, entities.monsters)
+    move_fireballs(game, entities.fireballs)
+    move_monsters(game, entities.monsters, entities.wander)
     game.hurt_counter -= 1
     #print(game.hurt_counter)
 
+# advance everything that moves by one step
+def advance_moves(game, entities):
+    game.moves.advance()
+    entities.advance()
+
+# remove complete moves and call their finished callback
+def clean_moves(game, entities):
+    game.moves.retire(game)
+    entities.retire()
+
+def is_player_moving(moves):
+    return moves.is_moving(PLAYER)
+
+# one step of the game logic, the same with or without a window
+# returns whether the player could take direction, False while it is still moving
+def tick(game, direction):
+    entities = level_entities(game.current_level)   # the player may leave the level only in move_player()
+    advance_moves(game, entities)
+    with profiler.phase("update"):
+        update(game, entities)
+    with profiler.phase("clean_moves"):
+        clean_moves(game, entities)
+    if not is_player_moving(game.moves):
+        with profiler.phase("move_player"):
+            move_player(game, direction)
+        return True
+    return False
+
 # collision check for fireballs, monsters
-def check_collision(game):
-    for f in game.current_level.fireballs:
-        if f.x == game.x and f.y == game.y and f.move.complete:
-            take_damage(game)
-
-def check_collision_monster(game):
-    for m in game.current_level.monsters:
-        if m.x == game.x and m.y == game.y and m.move.complete:
-            take_damage_monster(game, m)
-            #print('take damage')
\ No newline at end of file
+def check_collision(game, fireballs):
+    for _ in fireballs.standing_at(game.x, game.y):
+        take_damage(game)
+
+def check_collision_monster(game, monsters):
+    for i in monsters.standing_at(game.x, game.y).tolist():
+        take_damage_monster(game, monsters.entities[i])
+        #print('take damage')
@@ -0,0 +1,272 @@
+"""
+procedural dungeons
+
+generate_level() builds a Level from a seed and a size with array
+operations only, no loop over cells:
+
+    1. a binary-tree maze: every cell opens the wall to its north or east
+    2. extra openings, so the maze has loops, and rectangular rooms
+    3. the stairs at the end of a dead end, behind a locked door,
+       and the key somewhere else
+    4. coins, traps, potions, chests, teleporters, monsters and fireballs
+       on random floor cells, none of them right next to the spawn
+
+The same seed and size always give the same level.
+
+    python generator.py --width 1000 --height 1000 --seed 1
+"""
+import sys
+import time
+import argparse
+import numpy as np
+
+from levels import Level, Monster, Fireball, Chest, Teleporter, LevelCache, DIRECTIONS, NEIGHBOURS
+
+MONSTER_TYPES = ["rat", "giant", "skeleton", "spider", "snake", "bat", "slime", "undead"]
+CHEST_CONTENTS = ["potion", "armor"]
+BEHAVIORS = ["wander", "chase", "flee"]
+BEHAVIOR_SHARES = [0.5, 0.35, 0.15]
+
+LOOPS = 0.08            # share of the inner maze walls that are opened
+ROOM_CELLS = 150        # one room per this many maze cells
+ROOM_SIZES = [3, 5, 7, 9]
+
+# share of the free floor cells that get something
+DENSITY = {
+    "coins": 0.03,
+    "traps": 0.006,
+    "potions": 0.002,
+    "chests": 0.002,
+    "teleporters": 0.0005,  # pairs
+    "monsters": 0.006,
+    "fireballs": 0.003,
+}
+SAFE_DISTANCE = 2       # no traps, monsters or fireballs this close to the spawn
+
+
+def carve_maze(rng, width, height):
+    """
+    Returns a grid of walls and floor. Maze cells sit on odd coordinates,
+    a binary-tree maze is a spanning tree, so every cell can be reached.
+    """
+    grid = np.full((height, width), ord("#"), np.uint8)
+    rows, cols = (height - 1) // 2, (width - 1) // 2
+    grid[1:2 * rows:2, 1:2 * cols:2] = ord(".")
+
+    # open the north or the east wall of every cell
+    north = rng.random((rows, cols)) < 0.5
+    north[:, -1] = True                 # nothing east of the last column
+    north[0, :] = False                 # nothing north of the top row
+    east = ~north
+    east[:, -1] = False
+    ys, xs = np.nonzero(north)
+    grid[2 * ys, 2 * xs + 1] = ord(".")
+    ys, xs = np.nonzero(east)
+    grid[2 * ys + 1, 2 * xs + 2] = ord(".")
+
+    # open more walls between two cells, so there are loops
+    walls = np.zeros(grid.shape, bool)
+    walls[2:-2:2, 1:-1:2] = True        # between two cells on top of each other
+    walls[1:-1:2, 2:-2:2] = True        # between two cells side by side
+    walls &= grid == ord("#")
+    walls &= rng.random(grid.shape) < LOOPS
+    grid[walls] = ord(".")
+    return grid
+
+def carve_rooms(rng, grid):
+    # rectangular rooms, aligned to the maze cells so they open into the corridors
+    height, width = grid.shape
+    rows, cols = (height - 1) // 2, (width - 1) // 2
+    count = rows * cols // ROOM_CELLS
+    if count == 0:
+        return
+    sizes = rng.choice(ROOM_SIZES, size=(count, 2))
+    x0 = 2 * rng.integers(0, cols, count) + 1
+    y0 = 2 * rng.integers(0, rows, count) + 1
+    x1 = np.minimum(x0 + sizes[:, 0], 2 * cols)
+    y1 = np.minimum(y0 + sizes[:, 1], 2 * rows)
+    for a, b, c, d in zip(y0.tolist(), y1.tolist(), x0.tolist(), x1.tolist()):
+        grid[a:b, c:d] = ord(".")
+
+def floor_degree(grid):
+    # number of floor cells next to every cell
+    floor = grid == ord(".")
+    degree = np.zeros(grid.shape, np.uint8)
+    degree[1:, :] += floor[:-1, :]
+    degree[:-1, :] += floor[1:, :]
+    degree[:, 1:] += floor[:, :-1]
+    degree[:, :-1] += floor[:, 1:]
+    return degree
+
+def place_stairs(rng, grid, spawn):
+    """
+    Puts the stairs at the end of a dead end whose only neighbour is a
+    corridor, and a closed door on that neighbour, so the door blocks
+    nothing but the stairs. Prefers dead ends far from the spawn.
+    Returns the cells of the stairs and the door (None without door).
+    """
+    floor = grid == ord(".")
+    degree = floor_degree(grid)
+    ys, xs = np.nonzero(floor & (degree == 1))
+    # the neighbour of every dead end
+    nx, ny = xs.copy(), ys.copy()
+    for dx, dy in NEIGHBOURS:
+        inside = (xs + dx >= 0) & (xs + dx < grid.shape[1]) & (ys + dy >= 0) & (ys + dy < grid.shape[0])
+        open_ = np.zeros(len(xs), bool)
+        open_[inside] = floor[ys[inside] + dy, xs[inside] + dx]
+        nx[open_], ny[open_] = xs[open_] + dx, ys[open_] + dy
+    alcove = (degree[ny, nx] == 2) & floor[ny, nx]
+    sx, sy = spawn
+    far = np.abs(xs - sx) + np.abs(ys - sy) > SAFE_DISTANCE + 1
+    alcove &= far & ((nx != sx) | (ny != sy))
+
+    if alcove.any():
+        candidates = np.flatnonzero(alcove)
+    elif far.any():
+        candidates = np.flatnonzero(far)
+    else:
+        # no dead end at all, the farthest floor cell will do
+        fy, fx = np.nonzero(floor)
+        i = np.argmax(np.abs(fx - sx) + np.abs(fy - sy))
+        grid[fy[i], fx[i]] = ord("x")
+        return (int(fx[i]), int(fy[i])), None
+
+    # one of the farthest tenth
+    distance = np.abs(xs[candidates] - sx) + np.abs(ys[candidates] - sy)
+    best = candidates[np.argsort(distance)[-max(1, len(candidates) // 10):]]
+    i = rng.choice(best)
+    grid[ys[i], xs[i]] = ord("x")
+    if not alcove[i]:
+        return (int(xs[i]), int(ys[i])), None
+    grid[ny[i], nx[i]] = ord("d")
+    return (int(xs[i]), int(ys[i])), (int(nx[i]), int(ny[i]))
+
+def generate_level(seed, width=41, height=31, title=None):
+    """
+    Returns a new Level of the given size (at least 5 x 5; odd sizes fit the maze best).
+    """
+    if width < 5 or height < 5:
+        raise ValueError("A level needs at least 5 x 5 cells")
+    rng = np.random.default_rng(seed)
+    grid = carve_maze(rng, width, height)
+    carve_rooms(rng, grid)
+
+    fy, fx = np.nonzero(grid == ord("."))
+    i = rng.integers(len(fx))
+    spawn = (int(fx[i]), int(fy[i]))
+    stairs, door = place_stairs(rng, grid, spawn)
+
+    # everything else goes on free floor cells in random order
+    sx, sy = spawn
+    fy, fx = np.nonzero(grid == ord("."))
+    free = (fx != sx) | (fy != sy)
+    fx, fy = fx[free], fy[free]
+    order = rng.permutation(len(fx))
+    fx, fy = fx[order], fy[order]
+    # cells close to the spawn come last, they only get harmless things
+    safe = np.maximum(np.abs(fx - sx), np.abs(fy - sy)) > SAFE_DISTANCE
+    order = np.argsort(~safe, kind="stable")
+    fx, fy = fx[order].tolist(), fy[order].tolist()
+    counts = {kind: int(len(fx) * share) for kind, share in DENSITY.items()}
+    counts["teleporters"] *= 2
+    cells = {}
+    start = 0
+    if door is not None:
+        cells["key"] = [(fx[0], fy[0])]
+        start = 1
+    for kind, count in counts.items():
+        cells[kind] = list(zip(fx[start:start + count], fy[start:start + count]))
+        start += count
+
+    for kind, symbol in (("key", "k"), ("coins", "$"), ("traps", "t"), ("potions", "h")):
+        if cells.get(kind):
+            xs, ys = np.array(cells[kind]).T
+            grid[ys, xs] = ord(symbol)
+
+    teleporters = cells["teleporters"]
+    monsters = cells["monsters"]
+    fireballs = cells["fireballs"]
+    chests = cells["chests"]
+    monster_types = rng.integers(len(MONSTER_TYPES), size=len(monsters)).tolist()
+    directions = rng.integers(4, size=len(monsters) + len(fireballs)).tolist()
+    monster_speeds = rng.integers(1, 3, size=len(monsters)).tolist()
+    behaviors = rng.choice(len(BEHAVIORS), size=len(monsters), p=BEHAVIOR_SHARES).tolist()
+    fireball_speeds = rng.integers(1, 4, size=len(fireballs)).tolist()
+    contents = rng.integers(len(CHEST_CONTENTS), size=len(chests)).tolist()
+    return Level(
+        level=grid,
+        title=title or f"Depth {seed}",
+        spawn=list(spawn),
+        teleporters=[
+            Teleporter(x=a[0], y=a[1], target_x=b[0], target_y=b[1])
+            for a, b in zip(teleporters[0::2], teleporters[1::2])
+        ],
+        monsters=[
+            Monster(type=MONSTER_TYPES[t], x=x, y=y, direction=DIRECTIONS[d], speed=s, behavior=BEHAVIORS[b])
+            for (x, y), t, d, s, b in zip(monsters, monster_types, directions, monster_speeds, behaviors)
+        ],
+        fireballs=[
+            Fireball(x=x, y=y, direction=DIRECTIONS[d], speed=s)
+            for (x, y), d, s in zip(fireballs, directions[len(monsters):], fireball_speeds)
+        ],
+        chests=[Chest(x=x, y=y, contents=CHEST_CONTENTS[c]) for (x, y), c in zip(chests, contents)],
+    )
+
+
+class EndlessLevels:
+    """
+    An endless campaign: level n is generated from the seed and n. It can
+    be used like levels.LEVELS, prefetch() generates the next floor on a
+    background thread while the current one is played.
+    """
+
+    def __init__(self, seed, width=41, height=31, cache_size=4):
+        self.seed = seed
+        self.width = width
+        self.height = height
+        self.cache = LevelCache(cache_size, load=self.generate)
+
+    def __len__(self):
+        return sys.maxsize
+
+    def __getitem__(self, index):
+        if index < 0:
+            raise IndexError("Endless levels start at 0")
+        return self.cache.get(f"depth_{index}")
+
+    def generate(self, name):
+        index = int(name.split("_")[1])
+        seed = np.random.SeedSequence([self.seed, index])
+        level = generate_level(seed, self.width, self.height, title=f"Depth {index + 1}")
+        level._name = name
+        return level
+
+    def find(self, level):
+        # generated levels are not part of a campaign, savegames embed them
+        return None
+
+    def prefetch(self, index):
+        if index >= 0:
+            self.cache.prefetch(f"depth_{index}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a dungeon level.")
+    parser.add_argument("--width", type=int, default=41)
+    parser.add_argument("--height", type=int, default=31)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--show", action="store_true", help="print the grid")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    level = generate_level(args.seed, args.width, args.height)
+    elapsed = time.perf_counter() - start
+    if args.show:
+        print("\n".join(row.tobytes().decode("ascii") for row in level.level))
+    print(f"{args.width}x{args.height} in {elapsed * 1000:.1f} ms: "
+          f"{len(level.monsters)} monsters, {len(level.fireballs)} fireballs, "
+          f"{len(level.chests)} chests, {len(level.teleporters)} teleporters")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+runs the game logic without a window
+
+The engine drives the same tick() as the graphical main loop, but takes
+its input from a Python iterable instead of the keyboard and never renders.
+Run it directly to measure how many ticks per second the logic reaches:
+
+    python headless.py --ticks 100000
+"""
+import time
+import random
+import argparse
+from game import start_game, tick, DIRECTIONS
+
+
+class HeadlessEngine:
+
+    def __init__(self, game=None):
+        self.game = game if game is not None else start_game()
+        self.ticks = 0
+
+    def step(self, direction=None):
+        """Runs one tick. direction is 'up', 'down', 'left', 'right' or None."""
+        tick(self.game, direction)
+        self.ticks += 1
+        return self.game
+
+    def run(self, inputs, max_ticks=None):
+        """
+        Runs one tick per item of inputs until the inputs are exhausted,
+        the game is no longer running or max_ticks is reached.
+        Returns the number of ticks run.
+        """
+        start = self.ticks
+        for direction in inputs:
+            if self.game.status != "running":
+                break
+            if max_ticks is not None and self.ticks - start >= max_ticks:
+                break
+            self.step(direction)
+        return self.ticks - start
+
+
+def random_inputs(seed=None):
+    # endless random key presses, None means no key
+    rng = random.Random(seed)
+    choices = DIRECTIONS + [None]
+    while True:
+        yield rng.choice(choices)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the dungeon game without a window.")
+    parser.add_argument("--ticks", type=int, default=10000, help="number of ticks to run")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the game and the random input")
+    args = parser.parse_args(argv)
+
+    engine = HeadlessEngine(start_game(args.seed))
+    start = time.perf_counter()
+    ticks = engine.run(random_inputs(args.seed), max_ticks=args.ticks)
+    elapsed = time.perf_counter() - start
+    game = engine.game
+    print(f"{ticks} ticks in {elapsed:.3f}s ({ticks / elapsed:.0f} ticks/s), "
+          f"status: {game.status}, level: {game.level_number + 1}, "
+          f"coins: {game.coins}, health: {game.health}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+build-once cache for decoded and scaled images
+
+Images of one group (e.g. all tiles) are stored stacked in a single .npy file
+next to a .json manifest holding the scale and a hash of every source file.
+On startup the bundle is memory-mapped; only images whose source file changed
+are decoded again, after which the bundle is rewritten.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+import cv2
+
+CACHE_PATH = os.path.split(__file__)[0] + '/.cache'
+CACHE_VERSION = 1
+
+def read_image(filename: str, scale: int = 1) -> np.ndarray:
+    """
+    Reads an image from the given filename and scales it up by an integer factor.
+    If the image file does not exist, an error is created.
+    """
+    img = cv2.imread(filename)  # sometimes returns None
+    if img is None:
+        raise IOError(f"Image not found: '{filename}'")
+    if scale != 1:
+        # nearest neighbour, every pixel becomes a scale x scale block
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+    return img
+
+def file_hash(filename: str) -> str:
+    with open(filename, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def read_manifest(group: str) -> dict:
+    try:
+        with open(os.path.join(CACHE_PATH, group + ".json")) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == CACHE_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {}
+
+def write_bundle(group: str, names: list, hashes: dict, images: list, scale: int) -> None:
+    # write to temporary files first so a crash never leaves a broken cache behind
+    os.makedirs(CACHE_PATH, exist_ok=True)
+    bundle = os.path.join(CACHE_PATH, group + ".npy")
+    manifest = os.path.join(CACHE_PATH, group + ".json")
+    with open(bundle + ".tmp", "wb") as f:
+        np.save(f, np.stack(images))
+    with open(manifest + ".tmp", "w") as f:
+        json.dump({
+            "version": CACHE_VERSION,
+            "scale": scale,
+            "images": {name: {"index": i, "hash": hashes[name]} for i, name in enumerate(names)},
+        }, f)
+    os.replace(bundle + ".tmp", bundle)
+    os.replace(manifest + ".tmp", manifest)
+
+def load_images(group: str, filenames: dict, scale: int = 1) -> dict:
+    """
+    Returns {name: image} for the given {name: filename}.
+    All images of a group must have the same size after scaling.
+    Unchanged images are read-only views into the memory-mapped bundle.
+    """
+    names = sorted(filenames)
+    hashes = {name: file_hash(filenames[name]) for name in names}
+
+    manifest = read_manifest(group)
+    cached = manifest.get("images", {}) if manifest.get("scale") == scale else {}
+    bundle = None
+    if cached:
+        try:
+            bundle = np.load(os.path.join(CACHE_PATH, group + ".npy"), mmap_mode="r")
+        except (OSError, ValueError):
+            cached = {}
+
+    images = {}
+    stale = False
+    for name in names:
+        entry = cached.get(name)
+        if entry is not None and entry["hash"] == hashes[name] and entry["index"] < len(bundle):
+            images[name] = bundle[entry["index"]]
+        else:
+            images[name] = read_image(filenames[name], scale)
+            stale = True
+    if len(cached) != len(names):
+        stale = True  # images were added or removed
+
+    if stale:
+        try:
+            write_bundle(group, names, hashes, [images[name] for name in names], scale)
+        except OSError:
+            pass  # read-only install, keep the freshly decoded images
+    return images
@@ -0,0 +1,44 @@
+"""
+keys waiting for the game logic
+
+Keys go into an InputQueue with the time they were captured, and the main
+loop drains them tick by tick: a tick gets the keys captured before it
+became due. When the loop catches up several ticks after a slow frame,
+the keys are spread over those ticks instead of all landing on the first,
+and no key is lost because a frame took long.
+
+cv2.waitKey() only works on the thread that owns the window, so main.py
+captures the keys itself between frames. push() is thread-safe, any other
+input source may call it from its own thread.
+"""
+import time
+import threading
+from collections import deque
+
+
+class InputQueue:
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.events = deque()       # (time, key), oldest first
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.events)
+
+    def push(self, key, when=None):
+        with self.lock:
+            self.events.append((self.clock() if when is None else when, key))
+
+    def drain(self, until=None):
+        """Removes and returns the keys captured up to the time until (all of them if None), oldest first."""
+        keys = []
+        with self.lock:
+            events = self.events
+            while events and (until is None or events[0][0] <= until):
+                keys.append(events.popleft()[1])
+        return keys
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
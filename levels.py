@@ -1,17 +1,43 @@
-from pydantic import BaseModel
-from typing import Callable
-from moves import Move
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, BeforeValidator, PlainSerializer
+from typing import Callable, Annotated
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import json
 import random
+import threading
+import numpy as np
 
-class Move(BaseModel):
-    tile: str
-    from_x: int
-    from_y: int
-    speed_x: int
-    speed_y: int
-    progress: int = 0
-    complete: bool = False
-    finished: Callable = None
+LEVEL_PATH = os.path.join(os.path.split(__file__)[0], "level_data")
+CACHE_SIZE = 16     # parsed level templates kept in memory
+
+# tiles are stored as the character code of their symbol, one byte per cell
+def tile_table(symbols):
+    # lookup table from a tile code to True for the given symbols
+    table = np.zeros(256, bool)
+    table[list(symbols.encode("ascii"))] = True
+    return table
+
+WALKABLE = tile_table("t$wshk.D")           # the player can step onto these
+STANDABLE = tile_table(".Dws")              # ...and stays there once traps, coins, etc. are picked up
+FIREBALL_PASSABLE = tile_table("w.$ks")     # fireballs fly over coins and keys
+MONSTER_PASSABLE = tile_table("w.s$k")      # monsters move over coins and keys
+
+def to_grid(level):
+    # accepts a grid, a list of strings or a list of lists of characters (old savegames)
+    if isinstance(level, np.ndarray):
+        return level.astype(np.uint8, copy=False)
+    rows = ["".join(row) for row in level]
+    return np.frombuffer("".join(rows).encode("ascii"), np.uint8).reshape(len(rows), -1).copy()
+
+def grid_rows(grid):
+    return [row.tobytes().decode("ascii") for row in grid]
+
+Grid = Annotated[np.ndarray, BeforeValidator(to_grid), PlainSerializer(grid_rows, return_type=list[str])]
+
+# the index of a direction is its code in the entity arrays, rewinds and savegames
+DIRECTIONS = ["up", "down", "left", "right"]
+NEIGHBOURS = [(0, -1), (0, 1), (-1, 0), (1, 0)]     # dx, dy by direction code
 
 class Teleporter(BaseModel):
     x: int
@@ -29,7 +55,6 @@ class Fireball(BaseModel):
     x: int
     y: int
     direction: str
-    move: Move = None
     speed: int
 
 class Monster(BaseModel):
@@ -37,8 +62,8 @@ class Monster(BaseModel):
     x: int
     y: int
     direction: str
-    move: Move = None
     speed: int
+    behavior: str = "wander"    # "wander", "chase" or "flee" the player, see pathfinding.py
 
 class HealingPotion(BaseModel):
     x: int
@@ -55,8 +80,13 @@ class Armor(BaseModel):
     y: int
     worn: bool = False
 
+# entities that can be looked up by cell, see Level.at()
+INDEXED_KINDS = ("teleporters", "switches", "fireballs", "monsters", "chests")
+
 class Level(BaseModel):
-    level: list[list[str]]
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    level: Grid     # uint8 array of tile codes, indexed [y, x]
     title: str
     spawn: list[int]
     teleporters: list[Teleporter] = []
@@ -64,193 +94,244 @@ class Level(BaseModel):
     fireballs: list[Fireball] = []
     monsters: list[Monster] = []
     chests: list[Chest] = []
+    music: str = "dungeon_music_1"
+    # bookkeeping used every tick, kept in (unsaved) fields because reading
+    # pydantic private attributes is several times slower
+    dirty: set = Field(default_factory=set, exclude=True, repr=False)      # cells changed since the last redraw
+    index: dict = Field(default=None, exclude=True, repr=False)            # kind -> (x, y) -> list of entities
+    journal: list = Field(default=None, exclude=True, repr=False)          # (x, y, old tile code) for every set_tile(), while recording
+    flow: object = Field(default=None, exclude=True, repr=False)           # FlowField towards the player, see pathfinding.py
+    entities: object = Field(default=None, exclude=True, repr=False)       # LevelEntities, the fireballs and monsters as arrays, see entities.py
+    _template: "Level" = PrivateAttr(default=None)     # the level this one was copied from
+    _changes: dict = PrivateAttr(default_factory=dict) # (x, y) -> tile code, cells that differ from the template
+    _name: str = PrivateAttr(default=None)             # file in level_data the level was read from
+
+    def instance(self):
+        """
+        Returns a playable copy of this level, which stays an unchanged template.
+        The grid is shared until the copy changes its first tile, teleporters
+        and switches are always shared. Only the monsters, fireballs and
+        chests are copied, because they move or get opened.
+        """
+        self.level.flags.writeable = False      # templates are read-only
+        level = self.model_copy(update={
+            "fireballs": [f.model_copy() for f in self.fireballs],
+            "monsters": [m.model_copy() for m in self.monsters],
+            "chests": [c.model_copy() for c in self.chests],
+            # the copy starts with its own bookkeeping
+            "dirty": set(),
+            "index": None,
+            "journal": None,
+            "flow": None,
+            "entities": None,
+        })
+        level._template = self
+        level._changes = {}
+        return level
+
+    @property
+    def template(self):
+        return self._template
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def changes(self):
+        return self._changes
+
+    def tile(self, x, y):
+        return chr(self.level[y, x])
 
     def set_tile(self, x, y, character):
-        self.level[y][x] = character
-
-
-# turn level string into a list 
-def parse_level(level):
-    return [list(row) for row in level]
-
-# level definitions
-level_one = Level(level=parse_level([
-        "##########",
-        "#..$..$..#",
-        "#........#",
-        "#######..#",
-        "#........#",
-        "#.#$..$..#",
-        "#.#......#",
-        "#.########", 
-        "#.......x#",
-        "##########"
-    ]), 
-    title = "Level 1",
-    spawn = [1, 1],
-    )
-
-level_two = Level(level=parse_level([
-        "##########",
-        "#...###.$#",
-        "#.$..h...#",
-        "#.$.##...#",
-        "#.$.####.#",
-        "#......#t#",
-        "#wwww#.#.#",
-        "#wffw#.#.#", 
-        "#wwww#x#.#",
-        "##########"
-    ]),
-    spawn = [8, 8],
-    title = "Level 2", 
-    monsters = [Monster(x=2, y=5, type = 'rat', speed = 1, direction = 'down')]
-    )
-
-level_three  = Level(level=parse_level([
-        "##########",
-        "#........#",
-        "#...##.k.#",
-        "##d###...#",
-        "#...##...#",
-        "#.h.##...#",
-        "#...##...#",
-        "#w.w####.#", 
-        "#wxw##...#",
-        "##########"
-    ]),
-    spawn = [6, 8],
-    title = "Level 3", 
-    fireballs = [
-        Fireball(x=6, y=2, direction = "right", speed = 1),
-        Fireball(x=8, y=5, direction = "left", speed = 1)
-    ]
-    )
-
-level_four  = Level(level=parse_level([
-        "##########",
-        "#....h..x#",
-        "#d########",
-        "#........#",
-        "#..$.....#",
-        "#........#",
-        "#....$...#",
-        "##.#.....#", 
-        "##.#.....#",
-        "##########"
-    ]),
-    spawn = [2, 8],
-    title = "Level 4",
-    fireballs = [
-        Fireball(x=8, y=3, direction = "down", speed = 2),
-                ],
-    monsters = [Monster(x=6, y=8, direction = 'right', type = 'skeleton', speed = 1), 
-                 Monster(x=5, y = 5, direction = 'left', type = 'skeleton', speed = 1), 
-                 Monster(x=8, y=3, direction = 'down', type = 'giant', speed = 1)
-                ], 
-    chests = [Chest(x=8, y=8, contents = 'key'), Chest(x=2, y=7, contents = 'armor')], 
-    )
-
-level_five = Level(level=parse_level([
-        "##########",
-        "#........#",
-        "##########",
-        "##.......#",
-        "##.#.....#",
-        "##.#.....#",
-        "#x.#.....#",
-        "#..#.....#", 
-        "#........#",
-        "##########"
-    ]),
-    spawn = [8, 1],
-    title = "Level 5", 
-    fireballs = [
-        Fireball(x=4, y=3, direction = "down", speed = 5),
-        Fireball(x=5, y=6, direction = "up", speed = 5)
-                ],
-    teleporters = [
-        Teleporter(x = 1, y=1, target_x=8, target_y=8)
-    ], 
-    chests = [Chest(x = 2, y = 8, contents = 'armor')], 
-    monsters = [Monster(x = 6, y = 4, direction = 'down', type = 'spider', speed = 3)]
-    )
-
-level_six = Level(level=parse_level([
-        "##########",
-        "#xwwwwwww#",
-        "#wwwwwwww#",
-        "#wwwwwwww#",
-        "#wwwwwwww#",
-        "###wwwwww#",
-        "#wwwwwwww#",
-        "###wwwwww#", 
-        "#wwwwwwww#",
-        "##########"
-    ]),
-    spawn = [1, 6],
-    title = "Level 6", 
-    chests = [Chest(x = 1, y=8, contents = 'potion')], 
-    monsters = [Monster(x=1, y=1, type = 'giant', direction = 'down', speed = 1), 
-                Monster(x = 5, y = 3, type = 'spider', direction = 'left', speed = 2)], 
-    fireballs = [Fireball(x = 8, y=6, speed = 3, direction = 'left')]
-    )
-
-level_seven = Level(level=parse_level([
-        "##########",
-        "#ssssssss#",
-        "#ssssssss#",
-        "#ssssssss#",
-        "#ssssssss#",
-        "#ssssssss#",
-        "#ssssssss#",
-        "#ssssssss#", 
-        "#ssssssss#",
-        "##########"
-    ]),
-    spawn = [1, 1],
-    title = "Level 6", 
-    chests = [Chest(x = 1, y=8, contents = 'potion')], 
-    monsters = [Monster(x=1, y=1, type = 'skeleton', direction = 'down', speed = 5), 
-                Monster(x = 5, y = 3, type = 'snake', direction = 'left', speed = 2)], 
-    fireballs = [Fireball(x = 8, y=6, speed = 3, direction = 'left')]
-    )
-
-LEVELS = [level_one, level_two, level_three, level_four, level_five, level_six, level_seven]
-
-# secret level definitions
-
-secret_level_one = Level(level=parse_level([
-        "##########",
-        "#........#",
-        "#........#",
-        "#........#",
-        "#........#",
-        "#........#",
-        "#........#",
-        "#........#", 
-        "#........#",
-        "##########"
-    ]), 
-    spawn = [1, 1], 
-    title = "Level S1" 
-    )
-
-SECRET_LEVELS = [secret_level_one]
-
-# testing
-level_test = Level(level=parse_level([
-        "#####",
-        "#...#",
-        "#...#",
-        "#...#",
-        "#.$.#",
-        "#.$.#",
-        "#####"
-    ]), 
-    title = "TESTING",
-    spawn = [1, 1],
-    monsters = [Monster(x=3, y=3, type = 'rat', speed = 3, direction = 'left')], 
-    #fireballs = [Fireball(x=2, y=3, speed = 1, direction = 'up'), 
-                 #Fireball(x=3, y=3, speed = 1, direction = 'up')]
-    )
\ No newline at end of file
+        if not self.level.flags.writeable:
+            self.level = self.level.copy()      # copy on first write
+        old = int(self.level[y, x])
+        if self.journal is not None:
+            self.journal.append((x, y, old))
+        self.level[y, x] = ord(character)
+        if self.flow is not None:
+            self.flow.tile_changed(x, y, old, ord(character))
+        self._changes[(x, y)] = ord(character)
+        self.dirty.add((x, y))
+
+    def start_journal(self):
+        if self.journal is None:
+            self.journal = []
+
+    def pop_journal(self):
+        # the tiles changed since the last call, oldest first
+        journal = self.journal or []
+        if self.journal is not None:
+            self.journal = []
+        return journal
+
+    def mark_dirty(self, x, y):
+        self.dirty.add((x, y))
+
+    def pop_dirty(self):
+        # hand the changed cells to the renderer and start tracking again
+        dirty = self.dirty
+        self.dirty = set()
+        return dirty
+
+    def build_index(self):
+        """
+        Builds the spatial index: for every kind of entity a dictionary
+        from a cell to the entities on it. Entities that move must be moved
+        with move_entity() to keep it up to date.
+        """
+        self.index = {}
+        for kind in INDEXED_KINDS:
+            cells = {}
+            for entity in getattr(self, kind):
+                cells.setdefault((entity.x, entity.y), []).append(entity)
+            self.index[kind] = cells
+        return self.index
+
+    def at(self, kind, x, y):
+        # the teleporters, switches, chests, fireballs or monsters on a cell
+        index = self.index
+        if index is None:
+            index = self.build_index()
+        return index[kind].get((x, y), ())
+
+    def in_rect(self, kind, x0, y0, x1, y1):
+        """
+        Returns the entities of a kind on the cells x0 <= x < x1, y0 <= y < y1.
+        If there are more entities than cells, the cells are looked up in the index.
+        """
+        entities = getattr(self, kind)
+        if len(entities) <= (x1 - x0) * (y1 - y0):
+            return [e for e in entities if x0 <= e.x < x1 and y0 <= e.y < y1]
+        index = self.index
+        if index is None:
+            index = self.build_index()
+        cells = index[kind]
+        found = []
+        for y in range(y0, y1):
+            for x in range(x0, x1):
+                found.extend(cells.get((x, y), ()))
+        return found
+
+    def move_entity(self, entity, x, y):
+        index = self.index
+        if index is None:
+            index = self.build_index()
+        cells = index["fireballs" if isinstance(entity, Fireball) else "monsters"]
+        old = cells[(entity.x, entity.y)]
+        for i, e in enumerate(old):
+            if e is entity:
+                del old[i]
+                break
+        if not old:
+            del cells[(entity.x, entity.y)]
+        entity.x = x
+        entity.y = y
+        cells.setdefault((x, y), []).append(entity)
+
+
+# levels are stored in level_data: <name>.txt holds the grid, one row per line,
+# <name>.json everything else (title, spawn, monsters, ...)
+def read_level(name, path=LEVEL_PATH):
+    with open(os.path.join(path, name + ".txt")) as f:
+        rows = f.read().splitlines()
+    with open(os.path.join(path, name + ".json")) as f:
+        manifest = json.load(f)
+    level = Level.model_validate({**manifest, "level": rows})
+    level._name = name
+    return level
+
+
+class LevelCache:
+    """
+    Parsed level templates by name. At most size templates are kept, the
+    least recently used one is dropped first. prefetch() parses a level
+    on a background thread, so it is ready when the player gets there.
+    Levels are read from path, or made by load(name) if it is given.
+    Every level added is checked with reachability.check_level().
+    """
+
+    def __init__(self, size=CACHE_SIZE, path=LEVEL_PATH, load=None):
+        self.size = size
+        self.load = load if load is not None else (lambda name: read_level(name, path))
+        self.templates = OrderedDict()
+        self.pending = {}           # name -> Future of a prefetch
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get(self, name):
+        with self.lock:
+            if name in self.templates:
+                self.templates.move_to_end(name)
+                return self.templates[name]
+            future = self.pending.get(name)
+        if future is not None:
+            return future.result()
+        return self.add(name, self.load(name))
+
+    def add(self, name, level):
+        from reachability import check_level    # it needs the tile tables of this module
+        check_level(level, name)        # warns if the stairs cannot be reached
+        with self.lock:
+            self.pending.pop(name, None)
+            if name in self.templates:      # parsed twice at the same time, keep the first
+                return self.templates[name]
+            self.templates[name] = level
+            while len(self.templates) > self.size:
+                self.templates.popitem(last=False)
+            return level
+
+    def prefetch(self, name):
+        with self.lock:
+            if name in self.templates or name in self.pending:
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="levels")
+            self.pending[name] = self.executor.submit(lambda: self.add(name, self.load(name)))
+
+    def clear(self):
+        with self.lock:
+            self.templates.clear()
+
+
+class Campaign:
+    """
+    A sequence of levels by name, like a list of templates. Levels are
+    parsed when they are first needed.
+    """
+
+    def __init__(self, names, cache):
+        self.names = list(names)
+        self.cache = cache
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        return self.cache.get(self.names[index])
+
+    def __iter__(self):
+        return (self.cache.get(name) for name in self.names)
+
+    def find(self, level):
+        # index of a level (or the template of an instance) in the campaign, None if it is not part of it
+        template = level.template if level.template is not None else level
+        if template.name in self.names:
+            return self.names.index(template.name)
+        return None
+
+    def prefetch(self, index):
+        if 0 <= index < len(self.names):
+            self.cache.prefetch(self.names[index])
+
+
+def read_campaign(cache, path=LEVEL_PATH):
+    # the main and the secret levels, listed by name in campaign.json
+    with open(os.path.join(path, "campaign.json")) as f:
+        campaign = json.load(f)
+    return Campaign(campaign["levels"], cache), Campaign(campaign["secret_levels"], cache)
+
+level_cache = LevelCache()
+LEVELS, SECRET_LEVELS = read_campaign(level_cache)
@@ -5,9 +5,17 @@ import os
 import time
 import numpy as np
 import cv2
-from game import start_game, move_player, update
+import image_cache
+import audio
+from game import start_game, is_player_moving
 from cutscene import show_titlescreen, show_gameover, game_complete
-from levels import LEVELS
+import moves
+from clock import FixedTimestep
+from session import Session
+from inputs import InputQueue
+from replay import Recorder
+from profiling import profiler, IDLE
+from entities import level_entities
 
 TILE_PATH = os.path.split(__file__)[0] + '/tiles'
 MUSIC_PATH = os.path.split(__file__)[0] + '/music'
@@ -24,31 +32,14 @@ def create_message(text: str):
 # title of the game window
 GAME_TITLE = "Dungeon Explorer"
 
-# map keyboard keys to move commands
-MOVES = {
-    "a": "left",
-    "d": "right",
-    "w": "up",
-    "s": "down",
-}
-
-# controls are inverted when poisoned
-MOVES_POISONED = {
-    "a": "right",
-    "d": "left",
-    "w": "down",
-    "s": "up",
-}
-
 #
 # constants measured in pixels
 #
 
-TILE_SIZE = 64  
+TILE_SIZE = moves.TILE_SIZE  # also the distance of one move
 
 def get_level_size(game):
-    xdim = len(game.current_level.level[0])
-    ydim = len(game.current_level.level)
+    ydim, xdim = game.current_level.level.shape
     return xdim, ydim
 
 def read_image(filename: str) -> np.ndarray:
@@ -56,24 +47,25 @@ def read_image(filename: str) -> np.ndarray:
     Reads an image from the given filename and doubles its size.
     If the image file does not exist, an error is created.
     """
-    img = cv2.imread(filename)  # sometimes returns None
-    if img is None:
-        raise IOError(f"Image not found: '{filename}'")
-    img = np.kron(img, np.ones((2, 2, 1), dtype=img.dtype))  # double image size
-    return img
+    return image_cache.read_image(filename, scale=2)  # double image size
 
 def read_images():
-    return {
-        filename[:-4]: read_image(os.path.join(TILE_PATH, filename))
+    """
+    Returns all tiles at double size. They come from the on-disk image cache,
+    only tiles whose PNG changed since the last start are decoded again.
+    """
+    return image_cache.load_images("tiles", {
+        filename[:-4]: os.path.join(TILE_PATH, filename)
         for filename in os.listdir(TILE_PATH)
         if filename.endswith(".png")
-    }
+    }, scale=2)
 
 def read_music():
+    # music files by name, they are decoded by the mixer
     return {
-        filename[:-4]: read_image(os.path.join(MUSIC_PATH, filename))
+        os.path.splitext(filename)[0]: os.path.join(MUSIC_PATH, filename)
         for filename in os.listdir(MUSIC_PATH)
-        if filename.endswith(".png")
+        if filename.endswith((".mp3", ".ogg", ".wav"))
     }
 
 def draw_tile(frame, x, y, image, xbase=0, ybase=0):
@@ -84,36 +76,29 @@ def draw_tile(frame, x, y, image, xbase=0, ybase=0):
     # copy the image to the screen
     frame[ypos : ypos + TILE_SIZE, xpos : xpos + TILE_SIZE] = image
 
-def draw_move(frame, move, images):
-    draw_tile(frame, x=move.from_x, y=move.from_y, image=images[move.tile], xbase=move.progress * move.speed_x, ybase=move.progress * move.speed_y)
-    move.progress += 1
-
-def clean_moves(game, moves):
-    result = []
-    for m in moves:
-        if m.progress * max(abs(m.speed_x), abs(m.speed_y)) < TILE_SIZE:
-            result.append(m)
-        else:
-            m.complete = True
-            if m.finished is not None:
-                m.finished(game)
-    return result
-
-def is_player_moving(moves):
-    return any([m for m in moves if m.tile == "player" or m.tile == 'deep_elf_knight_new'])
-
-def is_fireball_moving(fireball):
-    if fireball.move == None or fireball.move.complete:
-        return False
-    else:
-        return True
+def blit(view, xpos, ypos, image):
+    # copy a tile to a pixel position, clipped to the view
+    height, width = view.shape[:2]
+    if 0 <= xpos <= width - TILE_SIZE and 0 <= ypos <= height - TILE_SIZE:
+        view[ypos : ypos + TILE_SIZE, xpos : xpos + TILE_SIZE] = image
+        return
+    left, top = max(xpos, 0), max(ypos, 0)
+    right, bottom = min(xpos + TILE_SIZE, width), min(ypos + TILE_SIZE, height)
+    if left < right and top < bottom:
+        view[top:bottom, left:right] = image[top - ypos:bottom - ypos, left - xpos:right - xpos]
+
+def move_position(move, alpha=0.0):
+    # pixel position of a moving tile in the level
+    # alpha interpolates between two logic ticks, a move never overshoots its tile
+    progress = move.progress + alpha
+    xbase = int(max(-TILE_SIZE, min(TILE_SIZE, progress * move.speed_x)))
+    ybase = int(max(-TILE_SIZE, min(TILE_SIZE, progress * move.speed_y)))
+    return move.from_x * TILE_SIZE + xbase, move.from_y * TILE_SIZE + ybase
+
+def draw_move(view, move, images, alpha=0.0, camera=(0, 0)):
+    xpos, ypos = move_position(move, alpha)
+    blit(view, xpos - camera[0], ypos - camera[1], images[move.tile])
 
-def is_monster_moving(monster):
-    if monster.move == None or monster.move.complete:
-        return False
-    else:
-        return True
-    
 # confirmation for saving and loading
 def saveload_confirm(frame):
     global message, msg_delay
@@ -128,114 +113,305 @@ def saveload_confirm(frame):
             ) 
     msg_delay -= 1
 
-def draw(game, images, moves):
-    # initialize screen
-    xdim, ydim = get_level_size(game)
-    SCREEN_SIZE_X, SCREEN_SIZE_Y = (xdim * TILE_SIZE)+128, ydim * TILE_SIZE
-    #SCREEN_SIZE_X, SCREEN_SIZE_Y = 1920, 1080
+# dictionary for symbols
+SYMBOLS = {".": "floor",
+           "#": "wall", 
+           "f": "fountain", 
+           "x": "stairs_down", 
+           "y": "stairs_up",
+           "$": "coin", 
+           "t": "trap",
+           "w": "water", 
+           "k": "key", 
+           "D": "open_door", 
+           "d": "closed_door", 
+           "h": "potion", 
+           "c": "chest", 
+           "s": "slime"}
+
+# the window shows at most VIEW_COLS x VIEW_ROWS tiles of the level, around the player
+VIEW_COLS = 20
+VIEW_ROWS = 12
+# tiles rendered around the viewport, the camera scrolls over them without rendering again
+VIEW_MARGIN = 8
+
+# pre-rendered background around the viewport and the frame buffer drawn on top of it
+background_cache = {"level": None, "region": None, "background": None, "frame": None}
+
+def draw_cell(frame, level, x, y, images, xbase=0, ybase=0):
+    """
+    Draws everything static on one cell: the dungeon tile,
+    a teleporter and a chest that has not been opened yet.
+    """
+    draw_tile(frame, x=x, y=y, image=images[SYMBOLS[level.tile(x, y)]], xbase=xbase, ybase=ybase)
+    for t in level.at("teleporters", x, y):
+        draw_tile(frame, x=x, y=y, image=images["teleporter"], xbase=xbase, ybase=ybase)
+    for c in level.at("chests", x, y):
+        if c.opened == False:
+            draw_tile(frame, x=x, y=y, image=images["chest"], xbase=xbase, ybase=ybase)
+
+# all tiles packed into one array, see get_atlas()
+tile_atlas = {"images": None, "atlas": None, "lookup": None}
+
+def build_atlas(images):
+    """
+    Packs the tile images into one contiguous array of shape
+    (tiles, TILE_SIZE, TILE_SIZE, 3) and returns it together with
+    a lookup table from the character code of a level symbol to its tile id.
+    """
+    names = list(images)
+    atlas = np.ascontiguousarray(np.stack([images[name] for name in names]))
+    lookup = np.full(256, -1, np.int16)
+    for symbol, name in SYMBOLS.items():
+        lookup[ord(symbol)] = names.index(name)
+    return atlas, lookup
+
+def get_atlas(images):
+    if tile_atlas["images"] is not images:
+        tile_atlas["atlas"], tile_atlas["lookup"] = build_atlas(images)
+        tile_atlas["images"] = images
+    return tile_atlas["atlas"], tile_atlas["lookup"]
+
+def get_tile_ids(level, lookup, region):
+    # turn the grid of tile codes in a region (x0, y0, x1, y1) into a grid of tile ids
+    x0, y0, x1, y1 = region
+    ids = lookup[level.level[y0:y1, x0:x1]]
+    if (ids < 0).any():
+        y, x = np.argwhere(ids < 0)[0]
+        raise KeyError(f"No tile for symbol '{level.tile(x0 + x, y0 + y)}' at x={x0 + x}, y={y0 + y}")
+    return ids
+
+def rasterize(ids, atlas):
+    """
+    Composes a grid of tile ids into one image in a single
+    gather/transpose/reshape pass instead of one blit per cell.
+    """
+    ydim, xdim = ids.shape
+    tiles = atlas[ids]     # (ydim, xdim, TILE_SIZE, TILE_SIZE, 3)
+    return tiles.transpose(0, 2, 1, 3, 4).reshape(ydim * TILE_SIZE, xdim * TILE_SIZE, 3)
+
+def render_background(level, images, region):
+    # the static part of the cells x0 <= x < x1, y0 <= y < y1
+    x0, y0, x1, y1 = region
+    atlas, lookup = get_atlas(images)
+    background = rasterize(get_tile_ids(level, lookup, region), atlas)
+    for t in level.in_rect("teleporters", x0, y0, x1, y1):
+        draw_tile(background, x=t.x - x0, y=t.y - y0, image=images["teleporter"])
+    for c in level.in_rect("chests", x0, y0, x1, y1):
+        if c.opened == False:
+            draw_tile(background, x=c.x - x0, y=c.y - y0, image=images["chest"])
+    return background
 
-    frame = np.zeros((SCREEN_SIZE_Y, SCREEN_SIZE_X, 3), np.uint8)
+def get_viewport(level):
+    # size of the visible part of the level in tiles
+    ydim, xdim = level.level.shape
+    return min(xdim, VIEW_COLS), min(ydim, VIEW_ROWS)
 
-    # text and icon for coin counter
+def get_camera(game, alpha=0.0):
+    """
+    Returns the top left corner of the viewport in level pixels. The camera
+    follows the player, also while it moves, and stays inside the level.
+    """
+    ydim, xdim = game.current_level.level.shape
+    cols, rows = get_viewport(game.current_level)
+    move = game.moves.get(moves.PLAYER)
+    if move is not None:
+        x, y = move_position(move, alpha)
+    else:
+        x, y = game.x * TILE_SIZE, game.y * TILE_SIZE
+    cam_x = min(max(x + (TILE_SIZE - cols * TILE_SIZE) // 2, 0), (xdim - cols) * TILE_SIZE)
+    cam_y = min(max(y + (TILE_SIZE - rows * TILE_SIZE) // 2, 0), (ydim - rows) * TILE_SIZE)
+    return cam_x, cam_y
+
+def get_region(level, camera):
+    # the cells under the viewport and VIEW_MARGIN more on every side
+    ydim, xdim = level.level.shape
+    cols, rows = get_viewport(level)
+    cam_x, cam_y = camera
+    return (max(cam_x // TILE_SIZE - VIEW_MARGIN, 0),
+            max(cam_y // TILE_SIZE - VIEW_MARGIN, 0),
+            min(-(-(cam_x + cols * TILE_SIZE) // TILE_SIZE) + VIEW_MARGIN, xdim),
+            min(-(-(cam_y + rows * TILE_SIZE) // TILE_SIZE) + VIEW_MARGIN, ydim))
+
+def get_background(level, images, camera):
+    """
+    Returns the pre-rendered background under the viewport.
+    The region around the viewport is rendered when the level changes or the
+    camera leaves it, otherwise only the cells marked dirty are redrawn.
+    """
+    cols, rows = get_viewport(level)
+    cam_x, cam_y = camera
+    region = background_cache["region"]
+    if (background_cache["level"] is not level
+            or cam_x < region[0] * TILE_SIZE or cam_x + cols * TILE_SIZE > region[2] * TILE_SIZE
+            or cam_y < region[1] * TILE_SIZE or cam_y + rows * TILE_SIZE > region[3] * TILE_SIZE):
+        level.pop_dirty()
+        region = get_region(level, camera)
+        background_cache["level"] = level
+        background_cache["region"] = region
+        background_cache["background"] = render_background(level, images, region)
+    else:
+        background = background_cache["background"]
+        x0, y0, x1, y1 = region
+        # changes outside the region are drawn when it is rendered again
+        for x, y in level.pop_dirty():
+            if x0 <= x < x1 and y0 <= y < y1:
+                draw_cell(background, level, x, y, images, xbase=-x0 * TILE_SIZE, ybase=-y0 * TILE_SIZE)
+    top, left = cam_y - region[1] * TILE_SIZE, cam_x - region[0] * TILE_SIZE
+    return background_cache["background"][top:top + rows * TILE_SIZE, left:left + cols * TILE_SIZE]
+
+def get_frame(cols, rows):
+    # the frame buffer: the viewport and the side panel
+    shape = (rows * TILE_SIZE, cols * TILE_SIZE + 128, 3)
+    if background_cache["frame"] is None or background_cache["frame"].shape != shape:
+        background_cache["frame"] = np.empty(shape, np.uint8)
+    return background_cache["frame"]
+
+# HUD text
+HUD_FONT = cv2.FONT_HERSHEY_SIMPLEX
+HUD_COLOR = (255, 128, 128)
+GLYPH_CHARS = "0123456789-"
+
+# pre-rasterized digits, built once by get_glyphs()
+glyph_atlas = {}
+
+# side panel, re-rendered only when what it shows changes
+hud_cache = {"key": None, "panel": None}
+
+def get_glyphs(font_scale=1.5, thickness=3):
+    """
+    Returns a glyph atlas: for every character in GLYPH_CHARS its image,
+    its mask, the offset of the text origin inside the image and its advance.
+    """
+    if (font_scale, thickness) not in glyph_atlas:
+        pad = thickness * 2
+        glyphs = {}
+        for char in GLYPH_CHARS:
+            (width, height), baseline = cv2.getTextSize(char, HUD_FONT, font_scale, thickness)
+            img = np.zeros((height + baseline + 2 * pad, width + 2 * pad, 3), np.uint8)
+            origin = (pad, pad + height)
+            cv2.putText(img, char, org=origin, fontFace=HUD_FONT, fontScale=font_scale,
+                        color=HUD_COLOR, thickness=thickness)
+            # the advance is the width a second glyph adds to the text
+            advance = cv2.getTextSize(char * 2, HUD_FONT, font_scale, thickness)[0][0] - width
+            glyphs[char] = (img, img.any(axis=2), origin, advance)
+        glyph_atlas[(font_scale, thickness)] = glyphs
+    return glyph_atlas[(font_scale, thickness)]
+
+def draw_number(panel, number, org, font_scale=1.5, thickness=3):
+    # blit the digits from the glyph atlas, like cv2.putText(panel, str(number), org, ...)
+    glyphs = get_glyphs(font_scale, thickness)
+    x, y = org
+    for char in str(number):
+        img, mask, (ox, oy), advance = glyphs[char]
+        top, left = y - oy, x - ox
+        bottom, right = top + img.shape[0], left + img.shape[1]
+        # clip the glyph to the panel
+        t, l = max(top, 0), max(left, 0)
+        b, r = min(bottom, panel.shape[0]), min(right, panel.shape[1])
+        if t < b and l < r:
+            np.copyto(panel[t:b, l:r], img[t - top:b - top, l - left:r - left],
+                      where=mask[t - top:b - top, l - left:r - left, None])
+        x += advance
+
+def render_hud(game, images, ydim):
+    panel = np.zeros((ydim * TILE_SIZE, 128, 3), np.uint8)
+
+    # icon and number for coin counter
     if game.coins < 10:
-        coin_text = SCREEN_SIZE_X - TILE_SIZE + 10
+        coin_text = TILE_SIZE + 10
     else:
-        coin_text = SCREEN_SIZE_X - TILE_SIZE
-    cv2.putText(frame,
-            str(game.coins),
-            org=(coin_text, 110),
-            fontFace=cv2.FONT_HERSHEY_SIMPLEX,
-            fontScale=1.5,
-            color=(255, 128, 128),
-            thickness=3,
-            )
-    draw_tile(frame, x=xdim, y=1, image=images["coin"])
-
-    # draw health icon and text
-    draw_tile(frame, x=xdim, y=0, image=images["heart"])
-    cv2.putText(frame,
-        str(game.health),
-        org=(SCREEN_SIZE_X - TILE_SIZE + 10, 110-64),
-        fontFace=cv2.FONT_HERSHEY_SIMPLEX,
-        fontScale=1.5,
-        color=(255, 128, 128),
-        thickness=3,
-        )
-    
-    # draw level label
-    cv2.putText(frame,
+        coin_text = TILE_SIZE
+    draw_number(panel, game.coins, org=(coin_text, 110))
+    draw_tile(panel, x=0, y=1, image=images["coin"])
+
+    # health icon and number
+    draw_tile(panel, x=0, y=0, image=images["heart"])
+    draw_number(panel, game.health, org=(TILE_SIZE + 10, 110-64))
+
+    # level label
+    cv2.putText(panel,
         str(game.current_level.title),
-        org=((SCREEN_SIZE_X - TILE_SIZE * 2) + 7, 600),
-        fontFace=cv2.FONT_HERSHEY_SIMPLEX,
+        org=(7, 600),
+        fontFace=HUD_FONT,
         fontScale=1,
-        color=(255, 128, 128),
+        color=HUD_COLOR,
         thickness=2,
-        )           
-
-    # draw dungeon tiles
-    symbols = {".": "floor",      # dictionary for symbols
-               "#": "wall", 
-               "f": "fountain", 
-               "x": "stairs_down", 
-               "y": "stairs_up",
-               "$": "coin", 
-               "t": "trap",
-               "w": "water", 
-               "k": "key", 
-               "D": "open_door", 
-               "d": "closed_door", 
-               "h": "potion", 
-               "c": "chest", 
-               "s": "slime"}
-    for y, row in enumerate(game.current_level.level):
-        for x, tile in enumerate(row):
-            draw_tile(frame, x=x, y=y, image=images[symbols[tile]])
-    
-    # draw teleporters
-    for t in game.current_level.teleporters:
-        draw_tile(frame, x=t.x, y=t.y, image=images["teleporter"])
-    
-    # draw chests
-    for c in game.current_level.chests:
-        if c.opened == False:
-            draw_tile(frame, x=c.x, y=c.y, image=images["chest"])
+        )
 
-    # draw armor
+    # armor
     if game.armor_worn == True:
-        draw_tile(frame, x=xdim, y=2, image=images["armor"])
-        cv2.putText(frame,
-            str(game.armor_health),
-            org=(SCREEN_SIZE_X - TILE_SIZE + 10, 110+64),
-            fontFace=cv2.FONT_HERSHEY_SIMPLEX,
-            fontScale=1.5,
-            color=(255, 128, 128),
-            thickness=3,
-            )
+        draw_tile(panel, x=0, y=2, image=images["armor"])
+        draw_number(panel, game.armor_health, org=(TILE_SIZE + 10, 110+64))
 
     # inventory
     for i, item in enumerate(game.items):
         y = i // 2
         x = i % 2
-        draw_tile(frame, xbase=xdim * TILE_SIZE, ybase=ydim + (64 * 3), x=x, y=y, image=images[item])
-
-    # draw player, fireball, monsters
-    while game.moves:
-        moves.append(game.moves.pop())
-    if not is_player_moving(moves):
+        draw_tile(panel, ybase=ydim + (64 * 3), x=x, y=y, image=images[item])
+    return panel
+
+# profiler overlay, below the inventory in the side panel
+PROFILE_LABELS = {"draw": "draw", "update": "update", "clean_moves": "clean",
+                  "move_player": "player", "handle_keyboard": "keys"}
+
+def draw_profile(frame, xpos, ypos=330):
+    fps, p50, p99, phases = profiler.stats()
+    counters = profiler.counters
+    lines = [f"fps {fps:.1f}", f"p50 {p50:.1f} ms", f"p99 {p99:.1f} ms",
+             f"moves {counters.get('moves', 0)}",
+             f"mon {counters.get('monsters', 0)} fb {counters.get('fireballs', 0)}"]
+    lines += [f"{label} {phases[name]:.2f}" for name, label in PROFILE_LABELS.items() if name in phases]
+    for i, line in enumerate(lines):
+        cv2.putText(frame, line, org=(xpos + 7, ypos + i * 13), fontFace=HUD_FONT,
+                    fontScale=0.4, color=HUD_COLOR, thickness=1)
+
+def get_hud(game, images):
+    ydim = get_viewport(game.current_level)[1]
+    key = (game.coins, game.health, game.armor_worn, game.armor_health,
+           tuple(game.items), game.current_level.title, ydim)
+    if hud_cache["key"] != key:
+        hud_cache["key"] = key
+        hud_cache["panel"] = render_hud(game, images, ydim)
+    return hud_cache["panel"]
+
+def draw(game, images, alpha=0.0):
+    # initialize screen from the cached background under the viewport
+    level = game.current_level
+    cols, rows = get_viewport(level)
+    camera = cam_x, cam_y = get_camera(game, alpha)
+    frame = get_frame(cols, rows)
+    view = frame[:, :cols * TILE_SIZE]
+    np.copyto(view, get_background(level, images, camera))
+
+    # side panel with health, coins, armor, level label and inventory
+    frame[:, cols * TILE_SIZE:] = get_hud(game, images)
+    if profiler.overlay:
+        draw_profile(frame, cols * TILE_SIZE)
+
+    # draw player, fireball, monsters, only those in view
+    if not is_player_moving(game.moves):
         if game.armor_worn == True:
-            draw_tile(frame=frame, x=game.x, y=game.y, image=images["deep_elf_knight_new"])
+            blit(view, game.x * TILE_SIZE - cam_x, game.y * TILE_SIZE - cam_y, images["deep_elf_knight_new"])
         else:
-            draw_tile(frame=frame, x=game.x, y=game.y, image=images["player"])
-    for f in game.current_level.fireballs:
-        if not is_fireball_moving(f):
-            draw_tile(frame=frame, x=f.x, y=f.y, image=images["fireball"])
-    for m in game.current_level.monsters:
-        if not is_monster_moving(m):
-            draw_tile(frame=frame, x=m.x, y=m.y, image=images[m.type])
-    
-    # draw everything that moves
-    for m in moves:
-        draw_move(frame=frame, move=m, images=images)
+            blit(view, game.x * TILE_SIZE - cam_x, game.y * TILE_SIZE - cam_y, images["player"])
+    x0, y0 = cam_x // TILE_SIZE, cam_y // TILE_SIZE
+    x1, y1 = -(-(cam_x + cols * TILE_SIZE) // TILE_SIZE), -(-(cam_y + rows * TILE_SIZE) // TILE_SIZE)
+    entities = level_entities(level)
+    groups = (entities.fireballs, entities.monsters)
+    visible = [group.visible(x0, y0, x1, y1) for group in groups]
+    for group, (standing, _) in zip(groups, visible):
+        for i, x, y in zip(standing.tolist(), group.x[standing].tolist(), group.y[standing].tolist()):
+            blit(view, x * TILE_SIZE - cam_x, y * TILE_SIZE - cam_y, images[group.tiles[i]])
+
+    # draw everything that moves, a move stays within one tile of where it started
+    for group, (_, moving) in zip(groups, visible):
+        xs, ys = group.pixel_positions(moving, alpha)
+        for i, x, y in zip(moving.tolist(), xs.tolist(), ys.tolist()):
+            blit(view, x - cam_x, y - cam_y, images[group.tiles[i]])
+    for m in game.moves:
+        if x0 - 1 <= m.from_x <= x1 and y0 - 1 <= m.from_y <= y1:
+            draw_move(view, move=m, images=images, alpha=alpha, camera=camera)
 
     # confirmation of save/load
     saveload_confirm(frame)
@@ -245,51 +421,57 @@ def draw(game, images, moves):
     return frame
 
 
-def handle_keyboard(game, frame):
-    # map keys to commands
-    from game import DungeonGame
-    
-    key = chr(cv2.waitKey(1) & 0xFF)
-    if key == "q":
-        game.status = "exited"
-    
-    # saving and loading
-    if key == "p":
-        save_time = time.asctime()
-        file_name = "savegame.json"
-        open(file_name, "w").write(game.model_dump_json())
-        create_message('Game Saved')
-    elif key == "o":
-        file_name = "savegame.json"
-        s = open(file_name, "r").read()
-        game = DungeonGame.model_validate_json(s)
-        create_message('Game Loaded')
-    
-    # cheat for level skipping
-    elif key == "m":
-        game.level_number += 1
-        game.current_level = LEVELS[game.level_number]
-    elif key == "n":
-        game.level_number -= 1
-        game.current_level = LEVELS[game.level_number]
-      
-    # poisoned
-    if game.player_state == 'poison':
-        return MOVES_POISONED.get(key), game
-    else:
-        return MOVES.get(key), game
-
+def handle_keyboard(inputs, code):
+    # queues a key code from cv2.waitKey() for the game logic
+    if code == -1:
+        return
+    key = chr(code & 0xFF)
 
-def main():
+    # profiler overlay and trace, not part of the game
+    if key == "f":
+        profiler.toggle_overlay()
+    elif key == "t":
+        create_message('Trace saved' if profiler.toggle_trace() else 'Tracing')
+    else:
+        inputs.push(key)
+
+def run_ticks(session, inputs, clock):
+    # every tick first gets the keys captured before it was due, the last one all that are left
+    due = clock.ticks()
+    for i in range(due):
+        until = clock.tick_time(i, due) if i < due - 1 else None
+        for key in inputs.drain(until):
+            text = session.handle_key(key)
+            if text:
+                create_message(text)
+        text = session.step()
+        if text:
+            create_message(text)
+        if session.game.status != "running":
+            break
+
+
+def main(seed=None, record=None, profile=False):
+    """
+    Runs the game in a window. With record, the keys of the session are
+    written to that file when the game ends, see replay.py.
+    With profile, the profiler overlay is shown from the start ('F' toggles it).
+    """
+    if profile:
+        profiler.toggle_overlay()
+    audio.init()
     images = read_images()
     show_titlescreen()
-    game = start_game()
+    game = start_game(seed)
+    recorder = Recorder(game.seed) if record else None
+    session = Session(game, recorder=recorder)
+    inputs = InputQueue()
     
     xdim, ydim, = get_level_size(game)
 
-    queued_move = None
-    moves = []
     counter = 0
+    clock = FixedTimestep()
+    frame = None
 
     # video
     '''tick = time.time()
@@ -300,19 +482,36 @@ def main():
                           60.0, 
                           (SCREEN_SIZE_X_video, SCREEN_SIZE_Y_video))'''
 
-    while game.status == "running":
-        #draw(game, images, moves)
-        frame = draw(game, images, moves)
-        update(game)
-        moves = clean_moves(game, moves)
-        queued_move, game = handle_keyboard(game, frame)
-        if not is_player_moving(moves):
-            move_player(game, queued_move)
+    while session.game.status == "running":
+        game = session.game
+        profiler.frame(moves=len(game.moves) + level_entities(game.current_level).count_moving(),
+                       monsters=len(game.current_level.monsters),
+                       fireballs=len(game.current_level.fireballs))
+        audio.play_music(game.current_level.music)   # changes and cross-fades with the level
+
+        # the logic runs at a fixed rate, keys wait in the queue for their tick
+        run_ticks(session, inputs, clock)
+        game = session.game
+
+        # skip drawing while the logic is behind
+        if frame is None or clock.should_draw():
+            with profiler.phase("draw"):
+                frame = draw(game, images, clock.alpha)
+
+        # waiting for a key is also what keeps the loop from spinning, it is timed apart from the keys
+        with profiler.phase(IDLE):
+            code = cv2.waitKey(clock.wait_ms())
+        with profiler.phase("handle_keyboard"):
+            handle_keyboard(inputs, code)
         
         # video
-        '''frame = draw(game, images, moves)
+        '''frame = draw(game, images)
         out.write(frame)'''
 
+    game = session.game
+    if recorder is not None and session.recorder is recorder:
+        recorder.save(record, session)
+
     if game.status == "game over":
         show_gameover()
     elif game.status == "finished":
@@ -320,7 +519,16 @@ def main():
     #elif game.status == "exited":
         #quit_game()
 
+    if profiler.tracing:
+        profiler.stop_trace()
     cv2.destroyAllWindows()
+    audio.close()
 
 if __name__ == '__main__':
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description=GAME_TITLE)
+    parser.add_argument("--seed", type=int, default=None, help="seed for the monsters")
+    parser.add_argument("--record", metavar="FILE", default=None, help="record the keys to replay them later")
+    parser.add_argument("--profile", action="store_true", help="show frame times in the side panel")
+    args = parser.parse_args()
+    main(seed=args.seed, record=args.record, profile=args.profile)
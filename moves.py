@@ -1,12 +1,97 @@
-from typing import Callable
-from pydantic import BaseModel
-
-class Move(BaseModel):
-    tile: str
-    from_x: int
-    from_y: int
-    speed_x: int
-    speed_y: int
-    progress: int = 0
-    complete: bool = False
-    finished: Callable = None
\ No newline at end of file
+"""
+animations of everything that moves from one tile to the next
+"""
+
+# a move is complete after travelling one tile (in pixels)
+TILE_SIZE = 64
+
+# owner of the player's moves, monsters and fireballs own their moves themselves
+PLAYER = "player"
+
+
+class Move:
+    __slots__ = ("tile", "from_x", "from_y", "speed_x", "speed_y",
+                 "progress", "complete", "finished", "owner")
+
+    def __init__(self, tile, from_x, from_y, speed_x, speed_y, finished=None, owner=None):
+        self.set(tile, from_x, from_y, speed_x, speed_y, finished, owner)
+
+    def set(self, tile, from_x, from_y, speed_x, speed_y, finished=None, owner=None):
+        self.tile = tile
+        self.from_x = from_x
+        self.from_y = from_y
+        self.speed_x = speed_x
+        self.speed_y = speed_y
+        self.progress = 0
+        self.complete = False
+        self.finished = finished    # called with the game when the move is complete
+        self.owner = owner
+
+
+class MovePool:
+    """
+    The active moves of a game. Complete moves go to a free list and are
+    reused, and the move of every owner can be looked up directly.
+    """
+
+    def __init__(self):
+        self.active = []
+        self.free = []
+        self.by_owner = {}     # id(owner) -> Move
+
+    def __iter__(self):
+        return iter(self.active)
+
+    def __len__(self):
+        return len(self.active)
+
+    def start(self, tile, from_x, from_y, speed_x, speed_y, finished=None, owner=None):
+        if self.free:
+            move = self.free.pop()
+            move.set(tile, from_x, from_y, speed_x, speed_y, finished, owner)
+        else:
+            move = Move(tile, from_x, from_y, speed_x, speed_y, finished, owner)
+        self.active.append(move)
+        if owner is not None:
+            self.by_owner[id(owner)] = move
+        return move
+
+    def is_moving(self, owner):
+        return id(owner) in self.by_owner
+
+    def get(self, owner):
+        # the move of an owner, None if it stands still
+        return self.by_owner.get(id(owner))
+
+    def advance(self):
+        for move in self.active:
+            move.progress += 1
+
+    def retire(self, game):
+        """Removes the moves that travelled a whole tile and calls their finished callback."""
+        # compact the active list in place
+        active = self.active
+        done = []
+        kept = 0
+        for move in active:
+            if move.progress * max(abs(move.speed_x), abs(move.speed_y)) < TILE_SIZE:
+                active[kept] = move
+                kept += 1
+            else:
+                done.append(move)
+        if not done:
+            return
+        del active[kept:]
+        for move in done:
+            move.complete = True
+            if move.owner is not None and self.by_owner.get(id(move.owner)) is move:
+                del self.by_owner[id(move.owner)]
+            if move.finished is not None:
+                move.finished(game)
+            move.finished = move.owner = None
+            self.free.append(move)
+
+    def clear(self):
+        self.free.extend(self.active)
+        self.active = []
+        self.by_owner = {}
@@ -0,0 +1,109 @@
+"""
+flow fields for monsters that chase or flee from the player
+
+One breadth-first search from the player gives the walking distance of
+every cell up to FLOW_RADIUS steps away, and all monsters of the level
+share it: a chasing monster steps to a neighbour closer to the player, a
+fleeing one to a neighbour farther away. Monsters beyond the radius have
+not noticed the player and wander.
+
+The search runs on the square around the player, one numpy step per
+distance, and only again when the player moved. Level.set_tile() passes
+changed cells to the field: a cell monsters can now pass only makes paths
+shorter, so the new distances are spread from that cell; a new wall is
+handled by searching the square again.
+"""
+from collections import deque
+import numpy as np
+
+from levels import MONSTER_PASSABLE, NEIGHBOURS
+
+FLOW_RADIUS = 16
+UNREACHED = np.iinfo(np.int32).max
+
+
+class FlowField:
+
+    def __init__(self, level, x, y, radius=FLOW_RADIUS):
+        self.level = level
+        self.x = x
+        self.y = y
+        self.radius = radius
+        height, width = level.level.shape
+        self.x0, self.y0 = max(x - radius, 0), max(y - radius, 0)
+        self.x1, self.y1 = min(x + radius + 1, width), min(y + radius + 1, height)
+        self.dist = None
+        self.search()
+
+    def passable(self):
+        return MONSTER_PASSABLE[self.level.level[self.y0:self.y1, self.x0:self.x1]]
+
+    def search(self):
+        # breadth-first search, the whole frontier grows by one step at a time
+        passable = self.passable()
+        dist = np.full(passable.shape, UNREACHED, np.int32)
+        frontier = np.zeros(passable.shape, bool)
+        frontier[self.y - self.y0, self.x - self.x0] = True
+        dist[frontier] = 0      # the player, even on a cell monsters cannot enter
+        for d in range(1, self.radius + 1):
+            grown = np.zeros_like(frontier)
+            grown[1:] |= frontier[:-1]
+            grown[:-1] |= frontier[1:]
+            grown[:, 1:] |= frontier[:, :-1]
+            grown[:, :-1] |= frontier[:, 1:]
+            frontier = grown & passable & (dist == UNREACHED)
+            if not frontier.any():
+                break
+            dist[frontier] = d
+        self.dist = dist
+
+    def distance(self, x, y):
+        # steps from the player to x, y, UNREACHED if it is too far or cannot be reached
+        if self.x0 <= x < self.x1 and self.y0 <= y < self.y1:
+            return int(self.dist[y - self.y0, x - self.x0])
+        return UNREACHED
+
+    def tile_changed(self, x, y, old, new):
+        """Called by Level.set_tile() with the old and new tile code."""
+        if not (self.x0 <= x < self.x1 and self.y0 <= y < self.y1):
+            return
+        if MONSTER_PASSABLE[old] == MONSTER_PASSABLE[new]:
+            return
+        if MONSTER_PASSABLE[new]:
+            self.opened(x - self.x0, y - self.y0)
+        else:
+            self.search()
+
+    def opened(self, x, y):
+        # spread shorter distances from a cell that became passable
+        dist = self.dist
+        height, width = dist.shape
+        best = min((dist[y + dy, x + dx] for dx, dy in NEIGHBOURS
+                    if 0 <= x + dx < width and 0 <= y + dy < height), default=UNREACHED)
+        if best >= self.radius or best + 1 >= dist[y, x]:
+            return
+        dist[y, x] = best + 1
+        passable = self.passable()
+        queue = deque([(x, y)])
+        while queue:
+            cx, cy = queue.popleft()
+            d = dist[cy, cx] + 1
+            if d > self.radius:
+                continue
+            for dx, dy in NEIGHBOURS:
+                nx, ny = cx + dx, cy + dy
+                if 0 <= nx < width and 0 <= ny < height and passable[ny, nx] and dist[ny, nx] > d:
+                    dist[ny, nx] = d
+                    queue.append((nx, ny))
+
+
+def flow_field(level, x, y):
+    """
+    Returns the flow field towards x, y shared by all monsters of the level.
+    It is searched again only when x, y changed.
+    """
+    flow = level.flow
+    if flow is None or flow.x != x or flow.y != y:
+        flow = FlowField(level, x, y)
+        level.flow = flow
+    return flow
@@ -0,0 +1,155 @@
+"""
+timing the phases of the main loop
+
+The loop wraps each phase in `with profiler.phase("draw"):` and calls
+profiler.frame() once per frame. Nothing is measured until the overlay or a
+trace is switched on, so the phases cost next to nothing otherwise.
+
+The overlay shows the frame rate, the median and 99th percentile frame time
+and the time per frame of every phase, averaged over the last WINDOW frames.
+The IDLE phase, the loop waiting for the next tick, is left out of those:
+it is not work, only what is left of the frame. Traces show it like the others.
+A trace records every phase as a Chrome trace event; open the file in
+chrome://tracing or https://ui.perfetto.dev.
+"""
+import os
+import json
+import time
+from collections import deque
+
+WINDOW = 120                    # frames in the rolling statistics
+MAX_TRACE_EVENTS = 500_000      # about a minute of play, then the trace stops growing
+TRACE_PATH = os.path.split(__file__)[0]
+IDLE = "idle"                   # the phase of waiting for the next tick
+
+
+class Phase:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns() if self.profiler.enabled else None
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self.profiler.add(self.name, self.start, time.perf_counter_ns())
+
+
+class Profiler:
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.overlay = False
+        self.tracing = False
+        self.enabled = False            # overlay or tracing
+        self.phases = {}                # name -> Phase
+        self.totals = {}                # name -> ns spent in the current frame
+        self.history = {}               # name -> ns per frame, for the last frames
+        self.frame_times = deque(maxlen=window)
+        self.frame_start = None
+        self.counters = {}              # e.g. live moves, monsters, fireballs of the current frame
+        self.events = []                # (name, start ns, duration ns) while tracing
+        self.counter_events = []        # (ns, counters) while tracing
+
+    def phase(self, name):
+        if name not in self.phases:
+            self.phases[name] = Phase(self, name)
+        return self.phases[name]
+
+    def add(self, name, start, end):
+        self.totals[name] = self.totals.get(name, 0) + end - start
+        if self.tracing and len(self.events) < MAX_TRACE_EVENTS:
+            self.events.append((name, start, end - start))
+
+    def frame(self, **counters):
+        """Ends the current frame and starts the next one."""
+        if not self.enabled:
+            self.frame_start = None
+            return
+        now = time.perf_counter_ns()
+        if self.frame_start is not None:
+            self.frame_times.append(now - self.frame_start)
+            for name in self.phases:
+                if name not in self.history:
+                    self.history[name] = deque(maxlen=self.window)
+                self.history[name].append(self.totals.get(name, 0))
+            if self.tracing and len(self.events) < MAX_TRACE_EVENTS:
+                self.events.append(("frame", self.frame_start, now - self.frame_start))
+        if self.tracing and counters:
+            self.counter_events.append((now, counters))
+        self.totals = {}
+        self.counters = counters
+        self.frame_start = now
+
+    def update_enabled(self):
+        self.enabled = self.overlay or self.tracing
+        if not self.enabled:
+            self.frame_times.clear()
+            self.history = {}
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        self.update_enabled()
+
+    def stats(self):
+        """
+        Returns frames per second, the median and 99th percentile frame time
+        in milliseconds and {phase: mean milliseconds per frame}, without IDLE.
+        """
+        times = sorted(self.frame_times)
+        if not times:
+            return 0.0, 0.0, 0.0, {}
+        fps = len(times) * 1e9 / sum(times)
+        p50 = times[len(times) // 2] / 1e6
+        p99 = times[min(len(times) - 1, len(times) * 99 // 100)] / 1e6
+        phases = {name: sum(h) / len(h) / 1e6 for name, h in self.history.items() if h and name != IDLE}
+        return fps, p50, p99, phases
+
+    #
+    # Chrome trace
+    #
+
+    def start_trace(self):
+        self.events = []
+        self.counter_events = []
+        self.tracing = True
+        self.update_enabled()
+
+    def stop_trace(self, filename=None):
+        """Stops tracing and writes the trace. Returns the filename."""
+        self.tracing = False
+        self.update_enabled()
+        if filename is None:
+            filename = os.path.join(TRACE_PATH, time.strftime("trace_%Y%m%d_%H%M%S.json"))
+        self.write_trace(filename)
+        self.events = []
+        self.counter_events = []
+        return filename
+
+    def toggle_trace(self):
+        """Starts a trace, or stops it and returns the filename it was written to."""
+        if self.tracing:
+            return self.stop_trace()
+        self.start_trace()
+        return None
+
+    def write_trace(self, filename):
+        pid = os.getpid()
+        events = [
+            {"name": name, "cat": name if name in ("frame", IDLE) else "phase", "ph": "X",
+             "ts": start / 1000, "dur": duration / 1000, "pid": pid, "tid": 1}
+            for name, start, duration in self.events
+        ]
+        events += [
+            {"name": "counts", "ph": "C", "ts": ts / 1000, "pid": pid, "tid": 1, "args": counters}
+            for ts, counters in self.counter_events
+        ]
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+profiler = Profiler()
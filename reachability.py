@@ -0,0 +1,293 @@
+"""
+can a level be finished?
+
+analyze() finds everything the player can reach from the spawn:
+
+    1. the walkable cells are split into connected regions with a few array
+       operations (label_regions()), so a region is one node of a small graph
+    2. teleporters lead from the region of their cell to their target,
+       switches reveal the secret stairs, keys on the floor or in chests
+       count for the region they are in or next to
+    3. while there are keys left and a closed door 'd' next to a reached
+       region, a door is opened, preferring doors next to the stairs,
+       then doors to regions not reached yet
+
+Only the walls of that graph are searched, never the cells one by one, so
+a generated 1000 x 1000 level takes a few tens of milliseconds. Keys are spent
+greedily, which is exact as long as every door that does not lead to the
+stairs has its own key on the way, as in all levels so far.
+
+Results are cached by a hash of the grid, the spawn and the entities that
+matter, levels.LevelCache checks every level it loads and warns about the
+ones whose stairs cannot be reached.
+
+    python reachability.py                  # the campaign
+    python reachability.py --generate 1001 1001 --seed 3
+"""
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import warnings
+from collections import OrderedDict
+import numpy as np
+from pydantic import BaseModel, ConfigDict, Field
+
+from levels import WALKABLE, NEIGHBOURS, tile_table
+
+CACHE_SIZE = 64         # analyses kept in memory
+
+SPECIAL = tile_table("dkxy")     # closed doors, keys and stairs
+
+
+class Analysis(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    stairs: bool                # the stairs 'x' can be reached
+    secret_stairs: bool         # stairs 'y' can be reached, or revealed by a switch that can be reached
+    has_stairs: bool            # the level has stairs 'x' at all
+    doors_opened: int
+    keys_left: int
+    unreachable: int            # walkable cells that cannot be reached
+    regions: int                # labels below this are regions, above closed doors
+    labels: np.ndarray = Field(repr=False)      # label of every cell, padded with a border of 0
+    reached: np.ndarray = Field(repr=False)     # by label
+
+    @property
+    def solvable(self):
+        return self.stairs
+
+    @property
+    def reachable(self):
+        # bool grid of the cells the player can get to, opened doors included
+        return self.reached[self.labels[1:-1, 1:-1]]
+
+    def unreachable_cells(self, limit=None):
+        # (x, y) of walkable cells that cannot be reached, row by row
+        labels = self.labels[1:-1, 1:-1]
+        ys, xs = np.nonzero((labels > 0) & (labels < self.regions) & ~self.reached[labels])
+        return list(zip(xs.tolist(), ys.tolist()))[:limit]
+
+    def problems(self):
+        problems = []
+        if not self.has_stairs:
+            problems.append("the level has no stairs")
+        elif not self.stairs:
+            problems.append("the stairs cannot be reached")
+        if self.unreachable:
+            cells = ", ".join(f"({x}, {y})" for x, y in self.unreachable_cells(5))
+            more = ", ..." if self.unreachable > 5 else ""
+            problems.append(f"{self.unreachable} walkable cells cannot be reached: {cells}{more}")
+        return problems
+
+
+def level_hash(level):
+    # everything analyze() looks at
+    h = hashlib.sha1()
+    h.update(np.array(level.level.shape, np.int64).tobytes())
+    h.update(np.ascontiguousarray(level.level).tobytes())
+    h.update(json.dumps([
+        level.spawn,
+        [[t.x, t.y, t.target_x, t.target_y] for t in level.teleporters],
+        [[s.x, s.y, s.door_x, s.door_y] for s in level.switches],
+        [[c.x, c.y] for c in level.chests if c.contents == "key" and not c.opened],
+    ]).encode("ascii"))
+    return h.hexdigest()
+
+def neighbour_labels(labels, xs, ys):
+    # labels of the 4 neighbours of every cell (padded coordinates), shape (cells, 4)
+    xs, ys = np.asarray(xs, np.intp), np.asarray(ys, np.intp)
+    return np.stack([labels[ys + dy, xs + dx] for dx, dy in NEIGHBOURS], axis=1)
+
+def label_regions(walkable):
+    """
+    Labels the 4-connected regions of a bool grid whose border is False.
+    Returns the number of labels, 0 (not walkable) included, and an int32
+    grid of labels numbered from 1, like cv2.connectedComponents().
+    """
+    height, width = walkable.shape
+    cells = walkable.ravel()
+    # the runs of walkable cells along the rows are the nodes, the border keeps runs from wrapping
+    starts = cells.copy()
+    starts[1:] &= ~cells[:-1]
+    runs = np.where(cells, np.cumsum(starts, dtype=np.int32), 0).reshape(height, width)
+    count = int(runs.max()) + 1
+
+    # runs touching the run below, joined by pointing the larger root at the smaller
+    # until no two roots touch; every round at least halves the number of trees
+    below = walkable[:-1] & walkable[1:]
+    a, b = runs[:-1][below], runs[1:][below]
+    parent = np.arange(count, dtype=np.int32)
+    while len(a):
+        np.minimum.at(parent, np.maximum(a, b), np.minimum(a, b))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        a, b = parent[a], parent[b]
+        apart = a != b
+        a, b = a[apart], b[apart]
+
+    roots = parent == np.arange(count)
+    numbers = np.cumsum(roots, dtype=np.int32) - 1      # run 0, the walls, stays 0
+    return int(roots.sum()), numbers[parent][runs]
+
+def analyze_grid(level):
+    # a border of walls, so every cell has 4 neighbours; coordinates below are shifted by 1
+    grid = np.pad(level.level, 1, constant_values=ord("#"))
+    count, labels = label_regions(WALKABLE[grid])
+
+    # the few cells that matter besides the regions, found in one pass
+    ys, xs = np.divmod(np.flatnonzero(SPECIAL[grid]), grid.shape[1])
+    symbols = grid[ys, xs]
+    cells = {symbol: (xs[symbols == ord(symbol)], ys[symbols == ord(symbol)]) for symbol in "dkxy"}
+
+    # closed doors get labels of their own after the regions, so doors next to each other are found
+    door_xs, door_ys = cells["d"]
+    doors = len(door_xs)
+    labels[door_ys, door_xs] = np.arange(count, count + doors)
+    door_neighbours = neighbour_labels(labels, door_xs, door_ys)
+    reached = np.zeros(count + doors, bool)    # label 0, the walls, is never reached
+
+    key_xs, key_ys = cells["k"]
+    keys = np.bincount(labels[key_ys, key_xs], minlength=count + doors)
+
+    # where teleporters lead: the target and its neighbours
+    teleports = {}
+    if level.teleporters:
+        sources = labels[[t.y + 1 for t in level.teleporters], [t.x + 1 for t in level.teleporters]]
+        target_xs = np.array([t.target_x + 1 for t in level.teleporters])
+        target_ys = np.array([t.target_y + 1 for t in level.teleporters])
+        targets = np.column_stack((labels[target_ys, target_xs], neighbour_labels(labels, target_xs, target_ys)))
+        for source, target in zip(sources.tolist(), targets.tolist()):
+            teleports.setdefault(source, []).extend(target)
+
+    # chests are opened by walking into them, a key in one counts for its cell and its neighbours
+    key_chests = [c for c in level.chests if c.contents == "key" and not c.opened]
+    chest_xs = np.array([c.x + 1 for c in key_chests], np.intp)
+    chest_ys = np.array([c.y + 1 for c in key_chests], np.intp)
+    chest_labels = np.column_stack((neighbour_labels(labels, chest_xs, chest_ys), labels[chest_ys, chest_xs]))
+    chest_taken = np.zeros(len(key_chests), bool)
+
+    stairs_neighbours = neighbour_labels(labels, *cells["x"])
+    door_at_stairs = np.isin(np.arange(count, count + doors), stairs_neighbours)
+
+    spawn_x, spawn_y = level.spawn[0] + 1, level.spawn[1] + 1
+    stack = [int(labels[spawn_y, spawn_x])] + neighbour_labels(labels, [spawn_x], [spawn_y])[0].tolist()
+    keys_left = 0
+    opened = np.zeros(doors, bool)
+    while True:
+        while stack:
+            label = stack.pop()
+            if label == 0 or label >= count or reached[label]:
+                continue
+            reached[label] = True
+            keys_left += int(keys[label])
+            stack.extend(teleports.get(label, ()))
+        # keys in chests next to a reached cell
+        found = ~chest_taken & reached[chest_labels].any(axis=1)
+        chest_taken |= found
+        keys_left += int(found.sum())
+
+        # open a door next to a reached region, if a key is left
+        frontier = ~opened & reached[door_neighbours].any(axis=1)
+        if keys_left == 0 or not frontier.any():
+            break
+        leads_on = frontier & ((door_neighbours > 0) & ~reached[door_neighbours]).any(axis=1)
+        choice = np.flatnonzero(frontier & door_at_stairs)
+        if not len(choice):
+            choice = np.flatnonzero(leads_on)
+        if not len(choice):
+            break
+        door = int(choice[0])
+        opened[door] = True
+        reached[count + door] = True
+        keys_left -= 1
+        stack.extend(door_neighbours[door].tolist())
+
+    # secret stairs: 'y' on the grid and the cells switches turn into 'y'
+    secret = reached[neighbour_labels(labels, *cells["y"])].any()
+    for s in level.switches:
+        if reached[labels[s.y + 1, s.x + 1]] and grid[s.door_y + 1, s.door_x + 1] == ord("#"):
+            secret = secret or reached[neighbour_labels(labels, [s.door_x + 1], [s.door_y + 1])].any()
+
+    unreachable = 0
+    if not reached[1:count].all():
+        areas = np.bincount(labels.ravel(), minlength=count + doors)
+        unreachable = int(areas[1:count][~reached[1:count]].sum())
+    return Analysis(
+        stairs=bool(reached[stairs_neighbours].any()),
+        secret_stairs=bool(secret),
+        has_stairs=len(stairs_neighbours) > 0,
+        doors_opened=int(opened.sum()),
+        keys_left=keys_left,
+        unreachable=unreachable,
+        regions=count,
+        labels=labels,
+        reached=reached,
+    )
+
+
+# analyses by level_hash(), shared by the level cache's threads
+analysis_cache = OrderedDict()
+cache_lock = threading.Lock()
+
+def analyze(level):
+    """Returns the Analysis of a level, from the cache if the same level was analyzed before."""
+    key = level_hash(level)
+    with cache_lock:
+        if key in analysis_cache:
+            analysis_cache.move_to_end(key)
+            return analysis_cache[key]
+    analysis = analyze_grid(level)
+    with cache_lock:
+        analysis_cache[key] = analysis
+        while len(analysis_cache) > CACHE_SIZE:
+            analysis_cache.popitem(last=False)
+    return analysis
+
+def check_level(level, name=None):
+    # warns if a level has stairs that cannot be reached, returns the analysis
+    # (the last levels of a campaign may have none)
+    analysis = analyze(level)
+    if analysis.has_stairs and not analysis.solvable:
+        warnings.warn(f"Level {name or level.title!r}: " + "; ".join(analysis.problems()), stacklevel=2)
+    return analysis
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that levels can be finished.")
+    parser.add_argument("names", nargs="*", help="levels in level_data (default: the campaign)")
+    parser.add_argument("--generate", nargs=2, type=int, metavar=("WIDTH", "HEIGHT"), help="check a generated level")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from levels import LEVELS, SECRET_LEVELS, read_level
+    if args.generate:
+        from generator import generate_level
+        levels = {f"generated {args.seed}": generate_level(args.seed, *args.generate)}
+    elif args.names:
+        levels = {name: read_level(name) for name in args.names}
+    else:
+        levels = {name: LEVELS.cache.get(name) for name in LEVELS.names + SECRET_LEVELS.names}
+
+    failed = 0
+    for name, level in levels.items():
+        start = time.perf_counter()
+        analysis = analyze_grid(level)
+        elapsed = time.perf_counter() - start
+        state = "ok" if analysis.solvable else "no stairs" if not analysis.has_stairs else "NOT SOLVABLE"
+        print(f"{name}: {state} in {elapsed * 1000:.1f} ms, {analysis.doors_opened} doors opened, "
+              f"{analysis.unreachable} unreachable cells"
+              + (", secret stairs" if analysis.secret_stairs else ""))
+        for problem in analysis.problems():
+            print("    " + problem)
+        failed += analysis.has_stairs and not analysis.solvable
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+recording and replaying sessions
+
+A recording is the seed of a game plus every key with the step it was
+pressed before. Replaying it drives a Session without a window, as fast as
+the CPU allows, and compares state hashes taken every CHECKPOINT_STEPS steps
+and at the end, so a replay proves that the game still behaves the same.
+
+    python main.py --record session.json     # play and record
+    python replay.py session.json            # replay and check
+    python replay.py --make random.json --steps 100000 --seed 1
+"""
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+from typing import Optional
+from pydantic import BaseModel
+
+import savegame
+from game import start_game
+from session import Session, MOVES
+
+RECORDING_VERSION = 1
+CHECKPOINT_STEPS = 600      # a state hash every ten seconds of play
+
+
+def state_hash(game):
+    # the savegame covers everything the logic depends on, including the random generator
+    return hashlib.sha1(savegame.encode(game)).hexdigest()
+
+
+class Recorder:
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.keys = []          # [step, key]
+        self.checkpoints = {}   # step -> state hash
+
+    def log(self, step, key):
+        self.keys.append([step, key])
+
+    def after_step(self, step, game):
+        if step % CHECKPOINT_STEPS == 0:
+            self.checkpoints[str(step)] = state_hash(game)
+
+    def save(self, filename, session):
+        with open(filename, "w") as f:
+            json.dump({
+                "version": RECORDING_VERSION,
+                "seed": self.seed,
+                "steps": session.steps,
+                "move_buffer": session.move_buffer,
+                "keys": self.keys,
+                "checkpoints": self.checkpoints,
+                "final": state_hash(session.game),
+            }, f)
+
+
+class ReplayResult(BaseModel):
+    ok: bool
+    steps: int
+    seconds: float
+    mismatch_step: Optional[int] = None     # first step whose state hash differs
+    final: str
+
+
+def replay(recording):
+    """Replays a recording (the dictionary saved by Recorder) and checks its hashes."""
+    if recording.get("version") != RECORDING_VERSION:
+        raise ValueError(f"Unsupported recording version {recording.get('version')}")
+    session = Session(start_game(recording["seed"]), savegames=False,
+                      move_buffer=recording["move_buffer"])
+    keys = recording["keys"]
+    checkpoints = recording.get("checkpoints", {})
+    next_key = 0
+    mismatch_step = None
+
+    start = time.perf_counter()
+    for step in range(recording["steps"]):
+        while next_key < len(keys) and keys[next_key][0] == step:
+            session.handle_key(keys[next_key][1])
+            next_key += 1
+        session.step()
+        expected = checkpoints.get(str(session.steps))
+        if expected is not None and mismatch_step is None and state_hash(session.game) != expected:
+            mismatch_step = session.steps
+    # keys pressed after the last step, like 'q'
+    for _, key in keys[next_key:]:
+        session.handle_key(key)
+    seconds = time.perf_counter() - start
+
+    final = state_hash(session.game)
+    if mismatch_step is None and final != recording["final"]:
+        mismatch_step = session.steps
+    return ReplayResult(ok=mismatch_step is None, steps=session.steps, seconds=seconds,
+                        mismatch_step=mismatch_step, final=final)
+
+
+def make_recording(filename, steps, seed):
+    """Records a session of random key presses, played without a window."""
+    rng = random.Random(seed)
+    recorder = Recorder(seed)
+    session = Session(start_game(seed), recorder=recorder, savegames=False)
+    keys = list(MOVES) + [None] * 4
+    while session.steps < steps and session.game.status == "running":
+        key = rng.choice(keys)
+        if key:
+            session.handle_key(key)
+        session.step()
+    recorder.save(filename, session)
+    return session
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded session without a window.")
+    parser.add_argument("recording", help="recording file (JSON)")
+    parser.add_argument("--make", action="store_true", help="record random key presses into the file instead")
+    parser.add_argument("--steps", type=int, default=10000, help="length of a random recording")
+    parser.add_argument("--seed", type=int, default=0, help="seed of a random recording")
+    args = parser.parse_args(argv)
+
+    if args.make:
+        session = make_recording(args.recording, args.steps, args.seed)
+        print(f"recorded {session.steps} steps, status: {session.game.status}")
+        return 0
+
+    with open(args.recording) as f:
+        recording = json.load(f)
+    result = replay(recording)
+    rate = result.steps / result.seconds if result.seconds else 0
+    if result.ok:
+        print(f"OK: {result.steps} steps in {result.seconds:.3f}s ({rate:.0f} steps/s)")
+        return 0
+    print(f"MISMATCH: state differs at step {result.mismatch_step}")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+rewinding the game tick by tick
+
+After every tick the buffer stores what is needed to undo it: the player
+values of the tick before in a preallocated ring of fixed-size records, and
+only the parts of the level that changed (tiles, moved monsters and
+fireballs, opened chests, a change of level). Memory per tick does not
+depend on the size of the level, and nothing is copied with model_dump.
+"""
+import numpy as np
+
+from game import PLAYER_STATES, STATUSES
+from levels import DIRECTIONS
+
+CAPACITY = 600      # ten seconds at 60 ticks per second
+
+PLAYER_DTYPE = np.dtype([
+    ("x", "<i4"), ("y", "<i4"), ("coins", "<i4"), ("health", "<i4"),
+    ("armor_health", "<i4"), ("armor_worn", "?"), ("hurt_counter", "<i8"),
+    ("level_number", "<i4"), ("secret_level_number", "<i4"),
+    ("player_state", "u1"), ("status", "u1"),
+])
+
+
+def player_record(game):
+    return (game.x, game.y, game.coins, game.health, game.armor_health, game.armor_worn,
+            game.hurt_counter, game.level_number, game.secret_level_number,
+            PLAYER_STATES.index(game.player_state), STATUSES.index(game.status))
+
+def entity_positions(level):
+    # x, y and direction of all fireballs followed by all monsters
+    if level.entities is not None:
+        return level.entities.positions()
+    entities = level.fireballs + level.monsters
+    positions = np.empty((len(entities), 3), np.int32)
+    for i, e in enumerate(entities):
+        positions[i] = (e.x, e.y, DIRECTIONS.index(e.direction))
+    return positions
+
+def chest_states(level):
+    return tuple(c.opened for c in level.chests)
+
+
+class RewindBuffer:
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.players = np.zeros(capacity, PLAYER_DTYPE)  # player before each recorded tick
+        self.deltas = [None] * capacity                   # level undo information, None if nothing changed
+        self.newest = -1
+        self.count = 0
+        self.level = None       # the state after the last recorded tick
+        self.player = None
+        self.items = None
+        self.positions = None
+        self.chests = None
+
+    def __len__(self):
+        return self.count
+
+    def capture(self, game):
+        """Remembers the current state as the one the next tick starts from."""
+        self.level = game.current_level
+        self.level.start_journal()
+        self.level.pop_journal()
+        self.player = player_record(game)
+        self.items = tuple(game.items)
+        self.positions = entity_positions(self.level)
+        self.chests = chest_states(self.level)
+
+    def clear(self):
+        self.newest = -1
+        self.count = 0
+        self.deltas = [None] * self.capacity
+        self.level = None
+
+    def record(self, game):
+        """Stores how to undo the tick that just ran."""
+        if self.level is None:
+            self.capture(game)
+            return
+        level = self.level      # the level at the start of the tick
+
+        # what changed on that level, even if the player left it during the tick
+        tiles = level.pop_journal()
+        positions = entity_positions(level)
+        moved = np.flatnonzero((positions != self.positions).any(axis=1))
+        entities = (moved, self.positions[moved]) if len(moved) else None
+        chests = chest_states(level)
+        items = tuple(game.items)
+
+        delta = None
+        if (tiles or entities is not None or chests != self.chests
+                or items != self.items or game.current_level is not level):
+            delta = (level, tiles, entities,
+                     self.chests if chests != self.chests else None,
+                     self.items if items != self.items else None)
+
+        self.newest = (self.newest + 1) % self.capacity
+        self.players[self.newest] = self.player
+        self.deltas[self.newest] = delta
+        self.count = min(self.count + 1, self.capacity)
+
+        if game.current_level is not level:
+            self.capture(game)
+        else:
+            self.player = player_record(game)
+            self.items = items
+            self.positions = positions
+            self.chests = chests
+
+    def rewind(self, game, ticks=1):
+        """
+        Undoes up to ticks recorded ticks, newest first.
+        Returns the number of ticks undone.
+        """
+        undone = 0
+        while undone < ticks and self.count:
+            self.undo(game, self.players[self.newest], self.deltas[self.newest])
+            self.deltas[self.newest] = None
+            self.newest = (self.newest - 1) % self.capacity
+            self.count -= 1
+            undone += 1
+        if undone:
+            game.moves.clear()
+            game.current_level.entities = None     # their moves are dropped too
+            self.capture(game)
+        return undone
+
+    def undo(self, game, player, delta):
+        (game.x, game.y, game.coins, game.health, game.armor_health, game.armor_worn,
+         game.hurt_counter, game.level_number, game.secret_level_number,
+         player_state, status) = player.tolist()
+        game.player_state = PLAYER_STATES[player_state]
+        game.status = STATUSES[status]
+        if delta is None:
+            return
+
+        level, tiles, entities, chests, items = delta
+        if game.current_level is not level:
+            game.current_level = level
+        for x, y, tile in reversed(tiles):
+            level.set_tile(x, y, chr(tile))
+        level.pop_journal()
+        if entities is not None:
+            all_entities = level.fireballs + level.monsters
+            for i, (x, y, direction) in zip(entities[0].tolist(), entities[1].tolist()):
+                e = all_entities[i]
+                level.move_entity(e, x, y)
+                e.direction = DIRECTIONS[direction]
+            level.entities = None       # made again from the objects
+        if chests is not None:
+            for c, opened in zip(level.chests, chests):
+                if c.opened != opened:
+                    c.opened = opened
+                    level.mark_dirty(c.x, c.y)
+        if items is not None:
+            game.items = list(items)
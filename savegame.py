@@ -0,0 +1,351 @@
+"""
+saving and loading games
+
+A savegame is a small binary snapshot. The level is stored as a reference to
+its template plus the cells that changed and the state of its monsters,
+fireballs and chests. Levels without a template are embedded as JSON.
+
+Files are written by a background thread: save() only takes the snapshot,
+the write goes to a temporary file that is renamed over the old savegame.
+load_async() reads and decodes a savegame on another background thread.
+
+    python savegame.py                      # checks that legacy_savegame.json still loads
+    python savegame.py savegame_1.sav       # ...or any other savegame
+
+File layout (little-endian), version 1:
+    header      magic b"DUNG", uint16 version
+    player      PLAYER_FORMAT, see encode()
+    random      RNG_FORMAT: seed and the state of the game's PCG64 generator
+    strings     status, player_state, items (uint16 count, then each string)
+    level       uint8 kind (LEVEL_MAIN/LEVEL_SECRET/LEVEL_EMBEDDED), uint32 index
+                embedded levels: uint32 length + JSON
+    changes     uint32 count + CHANGE_DTYPE records
+    fireballs   uint32 count + ENTITY_DTYPE records
+    monsters    uint32 count + ENTITY_DTYPE records
+    chests      uint32 count + one uint8 per chest (1 = opened)
+"""
+import os
+import io
+import sys
+import json
+import struct
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from game import DungeonGame
+from moves import MovePool
+from levels import Level, LEVELS, SECRET_LEVELS, DIRECTIONS
+
+SAVE_PATH = os.path.split(__file__)[0]
+SAVE_SLOTS = 3
+LEGACY_SAVEGAME = os.path.join(SAVE_PATH, "savegame.json")
+LEGACY_EXAMPLE = os.path.join(SAVE_PATH, "legacy_savegame.json")   # written by the first version of the game
+
+MAGIC = b"DUNG"
+VERSION = 1
+HEADER_FORMAT = "<4sH"
+# x, y, coins, health, armor_health, player_speed, level_number, secret_level_number, hurt_counter, armor_worn
+PLAYER_FORMAT = "<iiiiiiiiq?"
+# seed, PCG64 state and increment (128 bit each), has_uint32, uinteger
+RNG_FORMAT = "<Q16s16sBI"
+
+LEVEL_MAIN, LEVEL_SECRET, LEVEL_EMBEDDED = 0, 1, 2
+
+CHANGE_DTYPE = np.dtype([("x", "<u2"), ("y", "<u2"), ("tile", "u1")])
+ENTITY_DTYPE = np.dtype([("x", "<u2"), ("y", "<u2"), ("direction", "u1")])
+
+
+class SaveError(Exception):
+    pass
+
+
+def slot_path(slot):
+    return os.path.join(SAVE_PATH, f"savegame_{slot}.sav")
+
+
+#
+# encoding
+#
+
+def write_string(out, text):
+    data = text.encode("utf-8")
+    out.write(struct.pack("<H", len(data)))
+    out.write(data)
+
+def write_array(out, array):
+    out.write(struct.pack("<I", len(array)))
+    out.write(array.tobytes())
+
+def find_template(level):
+    if level.template is not None:
+        for kind, campaign in ((LEVEL_MAIN, LEVELS), (LEVEL_SECRET, SECRET_LEVELS)):
+            index = campaign.find(level)
+            if index is not None:
+                return kind, index
+    return LEVEL_EMBEDDED, 0
+
+def pack_rng(game):
+    state = game.rng.bit_generator.state
+    return struct.pack(RNG_FORMAT, game.seed,
+        state["state"]["state"].to_bytes(16, "little"),
+        state["state"]["inc"].to_bytes(16, "little"),
+        state["has_uint32"], state["uinteger"])
+
+def entity_records(entities):
+    records = np.empty(len(entities), ENTITY_DTYPE)
+    for i, e in enumerate(entities):
+        records[i] = (e.x, e.y, DIRECTIONS.index(e.direction))
+    return records
+
+def encode(game) -> bytes:
+    """Takes a snapshot of the game as bytes."""
+    out = io.BytesIO()
+    out.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION))
+    out.write(struct.pack(PLAYER_FORMAT,
+        game.x, game.y, game.coins, game.health, game.armor_health, game.player_speed,
+        game.level_number, game.secret_level_number, game.hurt_counter, game.armor_worn))
+    out.write(pack_rng(game))
+    write_string(out, game.status)
+    write_string(out, game.player_state)
+    out.write(struct.pack("<H", len(game.items)))
+    for item in game.items:
+        write_string(out, item)
+
+    level = game.current_level
+    kind, index = find_template(level)
+    out.write(struct.pack("<BI", kind, index))
+    if kind == LEVEL_EMBEDDED:
+        data = level.model_dump_json().encode("utf-8")
+        out.write(struct.pack("<I", len(data)))
+        out.write(data)
+        changes = {}
+    else:
+        changes = level.changes
+
+    records = np.empty(len(changes), CHANGE_DTYPE)
+    for i, ((x, y), tile) in enumerate(changes.items()):
+        records[i] = (x, y, tile)
+    write_array(out, records)
+    write_array(out, entity_records(level.fireballs))
+    write_array(out, entity_records(level.monsters))
+    write_array(out, np.array([c.opened for c in level.chests], np.uint8))
+    return out.getvalue()
+
+
+#
+# decoding
+#
+
+class Reader:
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+
+    def bytes(self, size):
+        data = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def string(self):
+        size, = self.unpack("<H")
+        return str(self.bytes(size), "utf-8")
+
+    def array(self, dtype):
+        count, = self.unpack("<I")
+        return np.frombuffer(self.bytes(count * dtype.itemsize), dtype)
+
+def unpack_rng(reader):
+    seed, state, inc, has_uint32, uinteger = reader.unpack(RNG_FORMAT)
+    rng = np.random.Generator(np.random.PCG64())
+    rng.bit_generator.state = {
+        "bit_generator": "PCG64",
+        "state": {"state": int.from_bytes(state, "little"), "inc": int.from_bytes(inc, "little")},
+        "has_uint32": has_uint32,
+        "uinteger": uinteger,
+    }
+    return seed, rng
+
+def set_entities(entities, records):
+    if len(entities) != len(records):
+        raise SaveError("Savegame does not match the level")
+    for e, (x, y, direction) in zip(entities, records.tolist()):
+        e.x = x
+        e.y = y
+        e.direction = DIRECTIONS[direction]
+
+def decode(data) -> DungeonGame:
+    """
+    Rebuilds a game from a snapshot. This is the fast path:
+    nothing is validated, the level is a fresh instance of its template
+    with the saved changes applied.
+    """
+    reader = Reader(data)
+    magic, version = reader.unpack(HEADER_FORMAT)
+    if magic != MAGIC:
+        raise SaveError("Not a savegame")
+    if version != VERSION:
+        raise SaveError(f"Unsupported savegame version {version}")
+    (x, y, coins, health, armor_health, player_speed,
+     level_number, secret_level_number, hurt_counter, armor_worn) = reader.unpack(PLAYER_FORMAT)
+    seed, rng = unpack_rng(reader)
+    status = reader.string()
+    player_state = reader.string()
+    items_count, = reader.unpack("<H")
+    items = [reader.string() for _ in range(items_count)]
+
+    kind, index = reader.unpack("<BI")
+    if kind == LEVEL_MAIN:
+        level = LEVELS[index].instance()
+    elif kind == LEVEL_SECRET:
+        level = SECRET_LEVELS[index].instance()
+    else:
+        size, = reader.unpack("<I")
+        level = Level.model_validate_json(bytes(reader.bytes(size)))
+
+    changes = reader.array(CHANGE_DTYPE)
+    if len(changes):
+        grid = level.level.copy()
+        grid[changes["y"], changes["x"]] = changes["tile"]
+        level.level = grid
+        level.changes.update(zip(zip(changes["x"].tolist(), changes["y"].tolist()), changes["tile"].tolist()))
+    set_entities(level.fireballs, reader.array(ENTITY_DTYPE))
+    set_entities(level.monsters, reader.array(ENTITY_DTYPE))
+    opened = reader.array(np.dtype("u1"))
+    if len(opened) != len(level.chests):
+        raise SaveError("Savegame does not match the level")
+    for c, o in zip(level.chests, opened.tolist()):
+        c.opened = bool(o)
+
+    return DungeonGame.model_construct(
+        status=status, player_state=player_state, armor_worn=armor_worn,
+        armor_health=armor_health, player_speed=player_speed,
+        current_level=level, level_number=level_number,
+        secret_level_number=secret_level_number, x=x, y=y,
+        moves=MovePool(), coins=coins, health=health, items=items,
+        hurt_counter=hurt_counter, seed=seed, rng=rng,
+    )
+
+
+#
+# background writer
+#
+
+class SaveWriter:
+    """Writes savegames on a background thread, one after the other."""
+
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.thread = None
+        self.error = None
+
+    def submit(self, path, data):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.work, daemon=True)
+            self.thread.start()
+        self.requests.put((path, data))
+
+    def work(self):
+        while True:
+            path, data = self.requests.get()
+            try:
+                write_atomic(path, data)
+            except OSError as e:
+                self.error = e
+            finally:
+                self.requests.task_done()
+
+    def flush(self):
+        """Waits until all submitted savegames are written."""
+        self.requests.join()
+
+    def pop_error(self):
+        # the error of a write that failed since the last call, or None
+        error, self.error = self.error, None
+        return error
+
+def write_atomic(path, data):
+    # a crash while writing never destroys the previous savegame
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+writer = SaveWriter()
+
+
+def save(game, slot=1):
+    """Snapshots the game now and writes it in the background."""
+    writer.submit(slot_path(slot), encode(game))
+
+def load_legacy(path):
+    """
+    Reads a savegame.json of the first version of the game, the whole game
+    as JSON. Its animations, the moves of the game and the move of every
+    fireball and monster, are dropped: they are not saved any more.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    data.pop("moves", None)
+    level = data.get("current_level", {})
+    for entity in level.get("fireballs", []) + level.get("monsters", []):
+        entity.pop("move", None)
+    return DungeonGame.model_validate(data)
+
+def load_file(path):
+    # a binary savegame, or a savegame.json of the first version
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(MAGIC):
+        return decode(data)
+    return load_legacy(path)
+
+def load(slot=1):
+    """
+    Loads the savegame of a slot. Savegames from before the binary format
+    (savegame.json) are still read for slot 1.
+    Raises FileNotFoundError if the slot is empty.
+    """
+    writer.flush()      # a save may still be on its way to the disk
+    path = slot_path(slot)
+    if not os.path.exists(path) and slot == 1 and os.path.exists(LEGACY_SAVEGAME):
+        return load_legacy(LEGACY_SAVEGAME)
+    with open(path, "rb") as f:
+        return decode(f.read())
+
+loader = None       # the thread of load_async(), started when first needed
+
+def load_async(slot=1):
+    """Starts loading the savegame of a slot in the background. Returns a Future of the game."""
+    global loader
+    if loader is None:
+        loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="savegame")
+    return loader.submit(load, slot)
+
+
+def main(argv=None):
+    failed = 0
+    for path in argv or [LEGACY_EXAMPLE]:
+        try:
+            game = load_file(path)
+        except (SaveError, struct.error, ValueError, OSError) as e:
+            print(f"{path}: cannot be loaded: {e}")
+            failed += 1
+            continue
+        level = game.current_level
+        print(f"{path}: {level.title!r} at ({game.x}, {game.y}), {len(level.fireballs)} fireballs, "
+              f"{len(level.monsters)} monsters, health {game.health}, coins {game.coins}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
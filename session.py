@@ -0,0 +1,150 @@
+"""
+one game being played
+
+A session turns keys into commands and runs the game one step at a time:
+a logic tick, or one tick of rewinding while 'r' is held. The window in
+main.py and the headless replay in replay.py both drive a session, so a
+recorded list of (step, key) pairs plays back exactly the same.
+
+Moves pressed while the player is still moving wait for it, up to
+move_buffer of them, so a key pressed during an animation is not lost.
+Loading a savegame happens in the background, the game is swapped by the
+first step after it was read.
+"""
+import struct
+from collections import deque
+
+import savegame
+from game import tick
+from levels import LEVELS
+from rewind import RewindBuffer
+
+# map keyboard keys to move commands
+MOVES = {
+    "a": "left",
+    "d": "right",
+    "w": "up",
+    "s": "down",
+}
+
+# controls are inverted when poisoned
+MOVES_POISONED = {
+    "a": "right",
+    "d": "left",
+    "w": "down",
+    "s": "up",
+}
+
+# keys that change the game and therefore go into a recording
+RECORDED_KEYS = set(MOVES) | set("qrmn")
+
+# steps rewound per 'r' key event, covers the gap until the key repeats
+REWIND_HOLD = 8
+
+# moves that can wait while the player moves, 0 drops keys pressed during a move
+MOVE_BUFFER = 1
+
+
+class Session:
+
+    def __init__(self, game, recorder=None, savegames=True, move_buffer=MOVE_BUFFER):
+        self.game = game
+        self.history = RewindBuffer()
+        self.recorder = recorder        # gets every recorded key with its step
+        self.savegames = savegames      # False ignores the save and load keys
+        self.save_slot = 1
+        self.move_buffer = move_buffer
+        self.moves = deque(maxlen=move_buffer + 1)    # the move for the next step and the ones waiting
+        self.loading = None             # Future of a savegame being loaded
+        self.rewind_steps = 0
+        self.steps = 0
+
+    def handle_key(self, key):
+        """
+        Applies a key pressed before the next step.
+        Returns a message for the player or None.
+        """
+        game = self.game
+        message = None
+        if self.recorder is not None and key in RECORDED_KEYS:
+            self.recorder.log(self.steps, key)
+
+        if key == "q":
+            game.status = "exited"
+
+        # rewind while the key is held
+        if key == "r":
+            self.rewind_steps = REWIND_HOLD
+
+        # saving and loading, the file is written and read in the background
+        if key in "po123" and not self.savegames:
+            pass
+        elif key == "p":
+            savegame.save(game, self.save_slot)
+            message = 'Game Saved'
+        elif key == "o":
+            if self.loading is None:
+                self.loading = savegame.load_async(self.save_slot)
+        elif key in "123" and int(key) <= savegame.SAVE_SLOTS:
+            self.save_slot = int(key)
+            message = f'Slot {self.save_slot}'
+
+        # cheat for level skipping
+        elif key == "m":
+            game.level_number += 1
+            game.current_level = LEVELS[game.level_number].instance()
+            LEVELS.prefetch(game.level_number + 1)
+        elif key == "n":
+            game.level_number -= 1
+            game.current_level = LEVELS[game.level_number].instance()
+
+        # poisoned
+        if game.player_state == 'poison':
+            direction = MOVES_POISONED.get(key)
+        else:
+            direction = MOVES.get(key)
+        if direction:
+            self.moves.append(direction)
+        return message
+
+    def finish_loading(self):
+        # swaps in a loaded savegame, returns a message once it is read
+        if self.loading is None or not self.loading.done():
+            return None
+        loading, self.loading = self.loading, None
+        try:
+            self.game = loading.result()
+        except FileNotFoundError:
+            return 'No Savegame'
+        except (savegame.SaveError, struct.error, ValueError, OSError):
+            return 'Savegame unreadable'    # the game goes on, ValueError covers pydantic's ValidationError
+        self.history.clear()
+        self.recorder = None    # a recording cannot contain a savegame
+        self.moves.clear()
+        return 'Game Loaded'
+
+    def step(self):
+        """
+        Runs one logic tick, or rewinds one tick while 'r' is held.
+        Returns a message for the player or None.
+        """
+        message = self.finish_loading()
+        if savegame.writer.pop_error() is not None:
+            message = 'Save Failed'     # 'Game Saved' was shown when the write started
+        game = self.game
+        if game.status != "running":
+            return message
+        if self.rewind_steps > 0:
+            self.history.rewind(game)
+            self.rewind_steps -= 1
+            self.moves.clear()
+        else:
+            if tick(game, self.moves[0] if self.moves else None) and self.moves:
+                self.moves.popleft()
+            self.history.record(game)
+        while len(self.moves) > self.move_buffer:
+            self.moves.popleft()        # the newest wait for the player
+        self.steps += 1
+        if self.recorder is not None:
+            self.recorder.after_step(self.steps, self.game)
+        return message